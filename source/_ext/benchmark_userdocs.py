@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+#
+# benchmark_userdocs.py
+#
+# This file is part of NEST.
+#
+# Copyright (C) 2004 The NEST Initiative
+#
+# NEST is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# NEST is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NEST.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark the stages of the user documentation extractor.
+
+A synthetic corpus of header files modeled on the NEST model headers in
+``source/models`` is generated and every stage of `extractor_userdocs` is
+timed on it separately. Results are written as JSON so that runs of
+different versions can be compared.
+
+Example
+-------
+
+    python benchmark_userdocs.py --files 5000 --tags 200 --output bench.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+import tempfile
+from pathlib import Path
+from statistics import median
+
+import extractor_userdocs as userdocs
+
+LICENSE_HEADER = """/*
+ *  {name}.h
+ *
+ *  This file is part of NEST.
+ *
+ *  Copyright (C) 2004 The NEST Initiative
+ *
+ *  NEST is free software: you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation, either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  NEST is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+ *
+ *  You should have received a copy of the GNU General Public License
+ *  along with NEST.  If not, see <http://www.gnu.org/licenses/>.
+ *
+ */
+
+#ifndef {guard}
+#define {guard}
+
+// Includes from nestkernel:
+#include "archiving_node.h"
+#include "connection.h"
+#include "event.h"
+#include "nest_types.h"
+#include "ring_buffer.h"
+
+namespace nest
+{{
+"""
+
+# the markers are filled in, so the extractor does not take this file for documentation
+USERDOCS = """
+/* {begin}: {tags}
+
+Short description
++++++++++++++++++
+
+{short}
+
+Description
++++++++++++
+
+{description}
+
+Parameters
+++++++++++
+
+The following parameters can be set in the status dictionary.
+
+=========== ======= ===========================================================
+{parameters}
+=========== ======= ===========================================================
+
+Sends
++++++
+
+SpikeEvent
+
+Receives
+++++++++
+
+SpikeEvent, CurrentEvent, DataLoggingRequest
+
+References
+++++++++++
+
+.. [1] Author A, Author B (2004). A synthetic reference for {name}.
+       Journal of Computational Neuroscience, 16:159-175.
+
+See also
+++++++++
+
+{seealso}
+
+{end} */
+"""
+
+CLASS_BODY = """
+class {name} : public ArchivingNode
+{{
+public:
+  {name}();
+  {name}( const {name}& );
+  ~{name}() override;
+
+  using Node::handle;
+  using Node::handles_test_event;
+
+  port send_test_event( Node&, rport, synindex, bool ) override;
+
+  void handle( SpikeEvent& ) override;
+  void handle( CurrentEvent& ) override;
+
+  void get_status( DictionaryDatum& ) const override;
+  void set_status( const DictionaryDatum& ) override;
+
+private:
+  void init_buffers_() override;
+  void pre_run_hook() override;
+  void update( Time const&, const long, const long ) override;
+}};
+
+}} // namespace
+
+#endif /* #ifndef {guard} */
+"""
+
+WORDS = ("membrane potential conductance synaptic current spike threshold reset refractory period "
+         "neuron model dynamics alpha exponential function integration input output device recorder "
+         "weight delay plasticity adaptation time constant reversal excitatory inhibitory").split()
+
+BASE_TAGS = ["neuron", "device", "synapse", "recorder", "generator", "integrate-and-fire",
+             "conductance-based", "current-based", "Hodgkin-Huxley", "adaptive threshold", "spike",
+             "rate", "binary", "STDP", "AEIF", "MAT", "multicompartment", "precise"]
+
+
+def make_vocabulary(ntags):
+    """
+    Return `ntags` distinct tag names, starting with real NEST tags.
+    """
+    tags = BASE_TAGS[:ntags]
+    tags += ["keyword %d" % num for num in range(len(tags), ntags)]
+    return tags
+
+
+def sentence(rng, nwords):
+    return " ".join(rng.choice(WORDS) for _ in range(nwords)).capitalize() + "."
+
+
+def generate_corpus(outdir, nfiles=1000, ntags=50, tags_per_file=3, doc_lines=40, nodoc_share=0.3, seed=0):
+    """
+    Write a synthetic corpus of NEST-style model headers.
+
+    Tags are drawn with Zipf-like frequencies, so a few tags are very common
+    and most are rare, as in the real model directory. Files are spread over
+    a few subdirectories.
+
+    Parameters
+    ----------
+    outdir : str, path
+        directory to create the corpus in
+    nfiles : int
+        number of header files
+    ntags : int
+        size of the tag vocabulary
+    tags_per_file : int
+        maximum number of tags of a documented file (at least one is used)
+    doc_lines : int
+        number of lines in the description section of each file
+    nodoc_share : float
+        share of files without user documentation
+    seed : int
+        seed of the random number generator
+
+    Returns
+    -------
+    dict
+        numbers of generated files and of files with documentation
+    """
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(ntags)
+    weights = [1.0 / (rank + 1) for rank in range(len(vocabulary))]
+    ndocumented = 0
+    for num in range(nfiles):
+        name = "model_%05d" % num
+        guard = name.upper() + "_H"
+        subdir = Path(outdir) / ("models_%d" % (num % 8))
+        subdir.mkdir(parents=True, exist_ok=True)
+        parts = [LICENSE_HEADER.format(name=name, guard=guard)]
+        if rng.random() >= nodoc_share:
+            ndocumented += 1
+            tags = list()
+            for _ in range(rng.randint(1, max(1, tags_per_file))):
+                tag = rng.choices(vocabulary, weights)[0]
+                if tag not in tags:
+                    tags.append(tag)
+            parts.append(USERDOCS.format(
+                begin=userdocs.BEGIN_USERDOCS,
+                end=userdocs.END_USERDOCS,
+                name=name,
+                tags=", ".join(tags),
+                short=sentence(rng, 8),
+                description="\n".join(sentence(rng, 10) for _ in range(doc_lines)),
+                parameters="\n".join(" %-10s %-7s %s" % ("p_%d" % i, "mV", sentence(rng, 6)) for i in range(8)),
+                seealso=", ".join("model_%05d" % rng.randrange(nfiles) for _ in range(3)),
+            ))
+        parts.append(CLASS_BODY.format(name=name, guard=guard))
+        (subdir / (name + ".h")).write_text("".join(parts), encoding="utf8")
+    return {"files": nfiles, "documented": ndocumented}
+
+
+def timed(function, repeat=3, setup=None):
+    """
+    Call `function` `repeat` times and return the wall times in seconds.
+
+    If given, `setup` is called before each run (not timed) and its result
+    is passed to `function`.
+    """
+    times = list()
+    for _ in range(repeat):
+        args = (setup(),) if setup else ()
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def run_benchmarks(corpus, outdir, repeat=3, maxtags=2):
+    """
+    Time every stage of the extractor on the corpus in `corpus`.
+
+    Returns
+    -------
+    dict
+        wall times of each stage, see `summarize()`
+    """
+    stages = dict()
+
+    files = list(userdocs.sourcefiles("*.h", basedir=corpus))
+    stages["sourcefiles"] = timed(lambda: list(userdocs.sourcefiles("*.h", basedir=corpus)), repeat)
+
+    stages["scan_files"] = timed(lambda: userdocs.TagIndex().scan_files(files), repeat)
+
+    # every run writes into a new directory, as unchanged files are not written again
+    def fresh_outdir():
+        return tempfile.mkdtemp(dir=outdir)
+
+    def extracted():
+        return list(userdocs.extract_docs(files)), fresh_outdir()
+    stages["renderpages"] = timed(lambda args: userdocs.renderpages(*args), repeat, setup=extracted)
+
+    index = userdocs.TagIndex()
+    for doc in userdocs.extract_docs(files, lazy=True):
+        index.update(doc.filename.with_suffix(".rst").name, doc.keywords)
+    combos = [sorted(combo) for combo, docs in userdocs.tag_combinations(index, maxtags)]
+
+    def hierarchies():
+        return [userdocs.make_hierarchy(index, *combo) for combo in combos]
+    stages["make_hierarchy"] = timed(hierarchies, repeat)
+    stages["CreateTagIndices"] = timed(lambda target: userdocs.CreateTagIndices(index, target, maxtags=maxtags),
+                                       repeat, setup=fresh_outdir)
+
+    hiers = list(zip(hierarchies(), combos))
+
+    def render_indices():
+        for hier, combo in hiers:
+            if any(hier.values()):
+                userdocs.rst_index(hier, combo)
+    stages["rst_index"] = timed(render_indices, repeat)
+
+    return {name: summarize(times) for name, times in stages.items()}
+
+
+def summarize(times):
+    return {"seconds": times, "min": min(times), "median": median(times)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the user documentation extractor on a synthetic corpus.")
+    parser.add_argument("--files", type=int, default=1000, help="number of header files")
+    parser.add_argument("--tags", type=int, default=50, help="size of the tag vocabulary")
+    parser.add_argument("--tags-per-file", type=int, default=3, help="maximum number of tags per file")
+    parser.add_argument("--doc-lines", type=int, default=40, help="lines of description per file")
+    parser.add_argument("--nodoc-share", type=float, default=0.3, help="share of files without user docs")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for the corpus")
+    parser.add_argument("--max-tags", type=int, default=2, help="maximum number of tags per index page")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs of each stage")
+    parser.add_argument("--corpus", help="directory for the corpus (default: a temporary directory)")
+    parser.add_argument("--output", help="file to write the JSON results to (default: stdout)")
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    parameters = {key: value for key, value in vars(args).items() if key not in ("corpus", "output")}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        corpus = args.corpus or os.path.join(tmpdir, "corpus")
+        outdir = os.path.join(tmpdir, "output")
+        os.makedirs(outdir)
+        counts = generate_corpus(corpus, args.files, args.tags, args.tags_per_file, args.doc_lines,
+                                 args.nodoc_share, args.seed)
+        stages = run_benchmarks(corpus, outdir, args.repeat, args.max_tags)
+
+    results = {
+        "version": 1,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": parameters,
+        "corpus": counts,
+        "stages": stages,
+    }
+    if args.output:
+        with open(args.output, "w") as outfile:
+            json.dump(results, outfile, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    for name, stage in stages.items():
+        print("%-18s %8.4f s (median of %d)" % (name, stage["median"], len(stage["seconds"])), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
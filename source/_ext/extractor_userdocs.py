@@ -23,23 +23,127 @@ import re
 from typing import List
 from tqdm import tqdm
 from pathlib import Path
-from pprint import pformat
-from copy import deepcopy
-from math import comb
 from textwrap import indent
 from itertools import chain
-from fnmatch import fnmatch, filter as fnfilter
+from fnmatch import translate
 from dataclasses import dataclass, field
 
+import io
 import os
+import sys
+import argparse
 import glob
 import json
-from itertools import chain, combinations
+import hashlib
+import mmap
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+from itertools import chain, combinations, groupby
+from operator import itemgetter
+from functools import partial
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import logging
-from collections import Counter
-logging.basicConfig(level=logging.DEBUG)
+from collections import Counter, OrderedDict
+from collections.abc import MutableMapping
 log = logging.getLogger()
 
+BEGIN_USERDOCS = "BeginUserDocs"
+END_USERDOCS = "EndUserDocs"
+TAGLINE_RE = re.compile(r':?\s*(?P<tags>[\w ,-]*)\s*$')
+# like the original pattern, any whitespace may follow a comma between tags
+TAG_SEPARATOR_RE = re.compile(r',\s+')
+
+
+class Metrics:
+    """
+    Per-stage counters of the extraction pipeline.
+
+    Every stage has a `Counter` of "calls", wall time in "seconds" and
+    whatever else the stage reports, e.g. "files", "bytes read" or
+    "bytes written". Recording is cheap and thread-safe, so it is always on;
+    `report()` formats the numbers for the ``--profile`` option.
+    """
+    def __init__(self):
+        self.stages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, stage, **values):
+        """
+        Add `values` to the counters of `stage`.
+        """
+        with self._lock:
+            self.stages.setdefault(stage, Counter()).update(values)
+
+    @contextmanager
+    def timed(self, stage, **values):
+        """
+        Count a call of `stage` and add the wall time spent in the block.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, calls=1, seconds=time.perf_counter() - start, **values)
+
+    def timed_chunks(self, stage, chunks, **values):
+        """
+        Yield from `chunks` and count a call of `stage` with the wall time
+        spent producing them, e.g. for a page that is rendered while a writer
+        thread streams it to its file. The time is also part of the stage
+        that consumes the chunks.
+        """
+        seconds = 0.0
+        chunks = iter(chunks)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    return
+                finally:
+                    seconds += time.perf_counter() - start
+                yield chunk
+        finally:
+            self.add(stage, calls=1, seconds=seconds, **values)
+
+    def merge(self, stages):
+        """
+        Add the counters of another `Metrics`, e.g. of a worker process.
+        """
+        for stage, values in stages.items():
+            self.add(stage, **values)
+
+    def reset(self):
+        with self._lock:
+            self.stages = OrderedDict()
+
+    def todict(self):
+        with self._lock:
+            return {stage: dict(values) for stage, values in self.stages.items()}
+
+    def report(self):
+        """
+        Return the counters as a text table.
+
+        Time spent in worker processes or writer threads is summed up, so
+        stages can add up to more than the total run time.
+        """
+        columns = ["calls", "seconds", "files", "bytes read", "bytes written"]
+        lines = ["%-28s" % "stage" + "".join("%15s" % column for column in columns)]
+        for stage, values in self.todict().items():
+            lines.append("%-28s" % stage + "".join(
+                "%15.3f" % values.get(column, 0) if column == "seconds" else "%15d" % values.get(column, 0)
+                for column in columns))
+        return "\n".join(lines)
+
+
+metrics = Metrics()
+
 
 class NoUserDocs(ValueError):
     def __init__(self, filename, message=None, *args, **kwargs):
@@ -49,122 +153,1441 @@ class NoUserDocs(ValueError):
         super().__init__(message, *args, **kwargs)
 
 
-@dataclass
+class NoUserDocsMarker(NoUserDocs):
+    """
+    Raised for files that do not even contain the marker starting user
+    documentation and were therefore never decoded or parsed.
+    """
+    def __init__(self, filename):
+        super().__init__(filename, f"No {BEGIN_USERDOCS} marker in {filename}")
+
+
+def find_userdocs(data):
+    """
+    Return the offset of the first line containing a `BEGIN_USERDOCS` marker.
+
+    Parameters
+    ----------
+    data : bytes, file
+       raw content of a source file or a file opened in binary mode. Files are
+       memory-mapped and searched without being read into memory.
+
+    Returns
+    -------
+    int
+       offset of the start of the line with the first marker, or -1 if there
+       is no marker at all
+    """
+    marker = BEGIN_USERDOCS.encode()
+    if isinstance(data, (bytes, bytearray)):
+        pos = data.find(marker)
+        return data.rfind(b'\n', 0, pos) + 1 if pos >= 0 else -1
+    if os.fstat(data.fileno()).st_size == 0:
+        return -1       # empty files can not be mapped
+    with mmap.mmap(data.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        pos = mapped.find(marker)
+        return mapped.rfind(b'\n', 0, pos) + 1 if pos >= 0 else -1
+
+
 class DocMeta:
-    filename: Path = field(default_factory=Path)
-    keywords: List[str] = field(default_factory=list)
-    userdoc: str = field(default_factory=str)
-    def __post_init__(self):
+    '''
+    Keywords and user documentation of a source file.
+
+    The documentation is kept as plain text until its `sections` are used.
+    From then on the section tree is the only representation of the
+    documentation and `userdoc` is serialized from it when it is read.
+
+    With `lazy=True` only the keywords and the position of the documentation
+    in the file are recorded; the text itself is read from the file when it
+    is first needed. This keeps indexing large trees cheap in memory.
+    '''
+    __slots__ = ('filename', 'keywords', '_userdoc', '_sections', '_span')
+
+    def __init__(self, filename=None, keywords=None, userdoc="", lazy=False):
+        self.filename = filename
+        self.keywords = keywords if keywords is not None else []
+        self._userdoc = userdoc
+        self._sections = None
+        self._span = None
         if self.filename is not None:
-            self._readfile()
+            self._readfile(lazy)
+
+    def __repr__(self):
+        return "%s(filename=%r, keywords=%r)" % (type(self).__name__, self.filename, self.keywords)
 
-    def _readfile(self):
+    @property
+    def userdoc(self):
+        if self._sections is not None:
+            return str(self._sections)
+        if self._span is not None:
+            self._load()
+        return self._userdoc
+
+    @userdoc.setter
+    def userdoc(self, text):
+        self._userdoc = text
+        self._sections = None
+        self._span = None
+
+    @property
+    def sections(self):
+        '''
+        Section tree of the documentation, parsed on first access.
+        '''
+        if self._sections is None:
+            self._sections = RstDocument.parse(self.userdoc)
+            self._userdoc = None
+        return self._sections
+
+    def _readfile(self, lazy=False):
         '''
         Extract the documentation meta sections.
+
+        Only the first block of user documentation in the file is used. The
+        file is searched for the begin marker without decoding it, then read
+        line by line from there and reading stops at the end of that block.
         '''
-        userdoc_re = re.compile(r'BeginUserDocs:?\s*(?P<tags>([\w -]+(,\s*)?)*)\n+(?P<doc>(.|\n)*)EndUserDocs')
-        match = None
-        with self.filename.open('r', encoding='utf8') as infile:
-            match = userdoc_re.search(infile.read())
-        if not match:
+        with self.filename.open('rb') as infile:
+            mtime = os.fstat(infile.fileno()).st_mtime_ns
+            start = find_userdocs(infile)
+            if start < 0:
+                raise NoUserDocsMarker(self.filename)
+            infile.seek(start)
+            block = next(scan_userdocs(infile, keep_text=not lazy, offset=start), None)
+            metrics.add("extract", **{"bytes read": infile.tell() - start})
+        if block is None:
             raise NoUserDocs(self.filename)
 
         log.info("extracted user documentation from %s...", self.filename)
-        self.keywords = list(t.strip() for t in match.group('tags').split(','))            # refactor this to re.split
-        self.userdoc = str(match.group('doc'))
+        self.keywords = block.keywords
+        if lazy:
+            self._userdoc = None
+            self._span = (block.start, block.end, mtime)
+        else:
+            self.userdoc = block.userdoc
+
+    def _load(self):
+        '''
+        Read the documentation recorded by a lazy scan.
+        '''
+        start, end, mtime = self._span
+        with self.filename.open('rb') as infile:
+            if os.fstat(infile.fileno()).st_mtime_ns == mtime:
+                infile.seek(start)
+                self.userdoc = infile.read(end - start).decode('utf8').replace('\r\n', '\n')
+                metrics.add("load", calls=1, **{"bytes read": end - start})
+                return
+        log.warning("%s changed since it was indexed, extracting again", self.filename)
+        self._readfile()
+
+    @classmethod
+    def from_block(cls, filename, block):
+        '''
+        Create the meta data of `filename` from an already extracted block
+        without reading the file again.
+        '''
+        meta = cls(None, list(block.keywords), block.userdoc)
+        meta.filename = filename
+        return meta
+
+
+@dataclass
+class UserDocBlock:
+    keywords: List[str] = field(default_factory=list)
+    userdoc: str = field(default_factory=str)
+    start: int = 0
+    end: int = 0
+
+
+def _decode_line(line):
+    text = line.decode('utf8')
+    if text.endswith('\r\n'):
+        text = text[:-2] + '\n'
+    return text
+
+
+def scan_userdocs(lines, keep_text=True, offset=0):
+    '''
+    Find all blocks of user documentation in the given lines.
+
+    A block starts at a line containing the `BEGIN_USERDOCS` marker, optionally
+    followed by a colon and a comma separated list of tags till the end of the
+    line. Tags may consist of letters, digits, underscores, spaces and hyphens;
+    a marker followed by anything else is not the start of a block. The block
+    ends right before the next `END_USERDOCS` marker. Empty lines directly
+    following the tag line are not part of the documentation.
+
+    Each line is looked at exactly once, so the scan is linear in the size of
+    the input, and nothing past the last requested block is read. Only the
+    lines with a begin marker and the documentation are decoded (as UTF-8).
+
+    Parameters
+    ----------
+    lines : iterable
+      lines of bytes including their line endings, e.g. a file opened in
+      binary mode
+    keep_text : bool
+      if false, only the position of the documentation is recorded and the
+      `userdoc` of all blocks is empty
+    offset : int
+      byte offset of the first line in the file, added to the reported
+      offsets
+
+    Yields
+    ------
+    UserDocBlock
+      keywords, documentation text and byte offsets of the start and end of
+      the documentation for each block
+    '''
+    begin_marker, end_marker = BEGIN_USERDOCS.encode(), END_USERDOCS.encode()
+    lines = iter(lines)
+    for line in lines:
+        offset += len(line)
+        begin = line.find(begin_marker)
+        if begin < 0:
+            continue
+        tagline = TAGLINE_RE.match(TAG_SEPARATOR_RE.sub(', ', line[begin + len(begin_marker):].decode('utf8')))
+        if not tagline:
+            continue
+        keywords = [t.strip() for t in tagline.group('tags').split(',')]
+        body = []
+        start = None
+        for line in lines:
+            linestart, offset = offset, offset + len(line)
+            if start is None:
+                if line in (b'\n', b'\r\n'):
+                    continue    # skip empty lines between tags and documentation
+                start = linestart
+            end = line.find(end_marker)
+            if end >= 0:
+                if keep_text:
+                    body.append(_decode_line(line[:end]))
+                end += linestart
+                break
+            if keep_text:
+                body.append(_decode_line(line))
+        else:
+            log.debug("unterminated user documentation block (tags: %s)", keywords)
+            return
+        yield UserDocBlock(keywords, ''.join(body), start, end)
+
+
+QUERY_TOKEN_RE = re.compile(r'\s*([&|!()]|[^&|!()]+)')
+
+
+def parse_query(expression):
+    """
+    Parse a boolean expression of tags.
+
+    Tags are combined with ``&`` (and), ``|`` (or) and ``!`` (not), in
+    decreasing order of precedence ``!``, ``&``, ``|``; parentheses group.
+    Anything between operators is a tag name with surrounding whitespace
+    removed, so tags may contain spaces and hyphens, e.g.
+    ``neuron & !adaptive threshold | (device & spike)``.
+
+    Returns
+    -------
+    tuple
+        expression tree of ``("tag", name)``, ``("not", node)``,
+        ``("and", nodes)`` and ``("or", nodes)`` nodes
+
+    Raises
+    ------
+    ValueError
+        if the expression is not well-formed
+    """
+    tokens = [token.strip() for token in QUERY_TOKEN_RE.findall(expression) if token.strip()]
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else None
+
+    def combine(op, parse_operand):
+        nonlocal pos
+        nodes = [parse_operand()]
+        while peek() == {"or": "|", "and": "&"}[op]:
+            pos += 1
+            nodes.append(parse_operand())
+        flat = []
+        for node in nodes:
+            flat.extend(node[1] if node[0] == op else (node,))
+        return flat[0] if len(flat) == 1 else (op, tuple(flat))
+
+    def parse_or():
+        return combine("or", parse_and)
+
+    def parse_and():
+        return combine("and", parse_not)
+
+    def parse_not():
+        nonlocal pos
+        token = peek()
+        if token == "!":
+            pos += 1
+            return ("not", parse_not())
+        if token == "(":
+            pos += 1
+            node = parse_or()
+            if peek() != ")":
+                raise ValueError("missing ')' in query %r" % expression)
+            pos += 1
+            return node
+        if token in (None, "&", "|", ")"):
+            raise ValueError("expected a tag at %r in query %r" % (token or "end", expression))
+        pos += 1
+        return ("tag", token)
+
+    tree = parse_or()
+    if pos < len(tokens):
+        raise ValueError("unexpected %r in query %r" % (tokens[pos], expression))
+    return tree
+
+
+class ExtractionCache:
+    """
+    Persistent cache of extracted user documentation.
+
+    Entries are keyed by the path of the source file and validated against
+    its modification time and size. If only the modification time changed, a
+    hash of the content decides whether the entry is still valid, so touching
+    a file does not force it to be parsed again. Files without user
+    documentation are remembered as well; files without any marker are only
+    searched for one, without being read or hashed, and their entries are
+    validated by modification time and size alone.
+
+    The cache holds at most `maxentries` files. When saved, the entries used
+    least recently are dropped first.
+    """
+    version = 2
+
+    def __init__(self, filename, maxentries=20000):
+        self.filename = Path(filename)
+        self.maxentries = maxentries
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._touched = {}
+        self._generation = 0
+        self._load()
+
+    def _load(self):
+        try:
+            with self.filename.open('r', encoding='utf8') as infile:
+                data = json.load(infile)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as exc:
+            log.warning("ignoring unreadable extraction cache %s: %s", self.filename, exc)
+            return
+        if data.get("version") != self.version:
+            log.info("discarding extraction cache %s from another version", self.filename)
+            return
+        self._entries = data.get("entries", {})
+        self._generation = data.get("generation", 0) + 1
+
+    def save(self):
+        """
+        Write the cache back to disk, evicting the least recently used
+        entries beyond `maxentries`.
+        """
+        if len(self._entries) > self.maxentries:
+            recent = sorted(self._entries.items(), key=lambda item: item[1]["used"], reverse=True)
+            self._entries = dict(recent[:self.maxentries])
+        self.filename.parent.mkdir(parents=True, exist_ok=True)
+        with self.filename.open('w', encoding='utf8') as outfile:
+            json.dump({"version": self.version, "generation": self._generation,
+                       "entries": self._entries}, outfile)
+        log.info("extraction cache: %d hits, %d misses, %d entries saved to %s",
+                 self.hits, self.misses, len(self._entries), self.filename)
+
+    def collect(self):
+        """
+        Return and forget the entries looked up since the last call.
 
+        Entries that were valid already are reported as `None`. This is used
+        to send the results of worker processes back to the main process,
+        see `merge()`.
+        """
+        touched, self._touched = self._touched, {}
+        return touched
+
+    def merge(self, touched, hits=0, misses=0):
+        """
+        Merge the entries returned by `collect()` of another instance.
+        """
+        for key, entry in touched.items():
+            if entry is None:
+                if key in self._entries:
+                    self._entries[key]["used"] = self._generation
+                continue
+            entry["used"] = self._generation
+            self._entries[key] = entry
+        self.hits += hits
+        self.misses += misses
+
+    def _hit(self, filename, entry, revalidated=False):
+        self.hits += 1
+        entry["used"] = self._generation
+        self._touched[str(filename)] = entry if revalidated else None
+        if entry.get("nomarker"):
+            raise NoUserDocsMarker(filename)
+        if entry["userdoc"] is None:
+            raise NoUserDocs(filename, entry.get("reason"))
+        return DocMeta.from_block(filename, UserDocBlock(entry["keywords"], entry["userdoc"]))
+
+    def extract(self, filename):
+        """
+        Return the `DocMeta` of `filename`, either from the cache or by
+        parsing the file.
+
+        Raises
+        ------
+        NoUserDocs
+          if the file contains no (readable) user documentation
+        """
+        key = str(filename)
+        stat = os.stat(filename)
+        entry = self._entries.get(key)
+        if entry and entry["mtime"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+            return self._hit(filename, entry)
+
+        with open(filename, 'rb') as infile:
+            # files without marker are only mapped, never read or hashed
+            start = find_userdocs(infile)
+            if start < 0:
+                self.misses += 1
+                entry = self._entries[key] = {
+                    "mtime": stat.st_mtime_ns, "size": stat.st_size, "digest": None,
+                    "used": self._generation, "keywords": [], "userdoc": None, "nomarker": True,
+                }
+                self._touched[key] = entry
+                raise NoUserDocsMarker(filename)
+            content = infile.read()
+        metrics.add("extract", **{"bytes read": len(content)})
+        digest = hashlib.sha256(content).hexdigest()
+        if entry and entry["size"] == stat.st_size and entry["digest"] == digest:
+            entry["mtime"] = stat.st_mtime_ns
+            return self._hit(filename, entry, revalidated=True)
+
+        self.misses += 1
+        entry = self._entries[key] = {
+            "mtime": stat.st_mtime_ns, "size": stat.st_size, "digest": digest,
+            "used": self._generation, "keywords": [], "userdoc": None,
+        }
+        self._touched[key] = entry
+        try:
+            block = next(scan_userdocs(io.BytesIO(content[start:]), offset=start), None)
+        except UnicodeDecodeError as exc:
+            entry["reason"] = "Could not decode %s: %s" % (filename, exc)
+            raise NoUserDocs(filename, entry["reason"]) from exc
+        if block is None:
+            raise NoUserDocs(filename)
+        log.info("extracted user documentation from %s...", filename)
+        entry["keywords"], entry["userdoc"] = block.keywords, block.userdoc
+        return DocMeta.from_block(filename, block)
 
 
 class TagIndex:
-    def __init__(self):
-        self._tagdict = {}
+    """
+    Map tags to the names of the documents carrying them.
+
+    Every document name gets an integer ID in the order it is first seen.
+    The documents of a tag are stored as a bitset (a Python `int` with bit
+    ID set for every document), so that intersections, unions and
+    differences of tags are single integer operations.
+
+    An index can be saved to a compact binary file with `save()` and opened
+    again with `load()` without scanning any source file. `sources` maps the
+    source files the index was built from to their fingerprints, so that
+    `stale()` can tell whether a loaded index is still up to date.
+    """
+    MAGIC = b"TAGIDX"
+    VERSION = 1
+    # magic, version, number of documents, tags and sources, size of the string table
+    HEADER = struct.Struct("<6sHIIII")
+    # modification time in ns and size of a source file
+    FINGERPRINT = struct.Struct("<qq")
+
+    def __init__(self, maxqueries=256):
+        self._names = []
+        self._ids = {}
+        self._bits = {}
+        self.sources = {}
+        self.maxqueries = maxqueries
+        self.hits = 0
+        self.misses = 0
+        self._queries = OrderedDict()
+        self._counts = {}
+        self._all = None
+
+    def _invalidate(self):
+        """
+        Forget everything derived from the bitsets, on every change.
+        """
+        self._queries.clear()
+        self._counts.clear()
+        self._all = None
+
+    @classmethod
+    def fromdict(cls, tags):
+        """
+        Create an index from a dictionary mapping tags to lists of names.
+        """
+        index = cls()
+        for tag, names in tags.items():
+            for name in names:
+                index.update(name, [tag])
+        return index
+
+    def docid(self, name):
+        """
+        Return the integer ID of the document `name`, assigning a new one if
+        it is not known yet.
+        """
+        docid = self._ids.get(name)
+        if docid is None:
+            docid = self._ids[name] = len(self._names)
+            self._names.append(name)
+        return docid
 
     def update(self, name, tags):
         for tag in tags:
             if not tag.strip():
                 log.warning("skipping tag %s for %s", repr(tag), name)
                 continue
-            self._tagdict.setdefault(tag, list()).append(name)
+            self._bits[tag] = self._bits.get(tag, 0) | (1 << self.docid(name))
+        self._invalidate()
+
+    def replace(self, name, tags):
+        """
+        Set the tags of the document `name` to exactly `tags`.
+
+        Unlike `discard()` followed by `update()`, the tags the document
+        keeps are not removed and added again, so the order of tags does not
+        change when a document is indexed again with the same tags.
+        """
+        docid = self._ids.get(name)
+        if docid is not None:
+            keep = set(tags)
+            mask = ~(1 << docid)
+            for tag in [tag for tag in self._bits if tag not in keep]:
+                self._bits[tag] &= mask
+                if not self._bits[tag]:
+                    del self._bits[tag]
+        self.update(name, tags)
+
+    def discard(self, name):
+        """
+        Remove the document `name` from all tags. Tags without any documents
+        left are removed. The document keeps its ID if it is added again.
+        """
+        docid = self._ids.get(name)
+        if docid is None:
+            return
+        mask = ~(1 << docid)
+        for tag in list(self._bits):
+            self._bits[tag] &= mask
+            if not self._bits[tag]:
+                del self._bits[tag]
+        self._invalidate()
+
+    def __len__(self):
+        """
+        Number of documents with at least one tag.
+        """
+        return self.count(self.union(*self._bits))
 
     @property
     def tags(self):
-        yield from self._tagdict.keys()
+        yield from self._bits.keys()
 
     @property
     def files(self):
-        yield from set.union(*[set(x) for x in tagdict.values()])
+        """
+        Names of all documents with at least one tag, ordered by ID.
+        """
+        yield from self.names(self.everything())
 
     def __getitem__(self, tag):
-        return self._tagdict[tag]
+        return self.names(self._bits[tag])
 
-    def scan_files(self, filenames):
-        log.info("indexing keywords...")
-        nfiles, nfiles_total = 0, 0
-        for filename in filenames:
-            nfiles_total += 1
+    def __contains__(self, tag):
+        return tag in self._bits
+
+    def bits(self, tag):
+        """
+        Return the bitset of documents tagged with `tag` (0 for unknown tags).
+        """
+        return self._bits.get(tag, 0)
+
+    def everything(self):
+        """
+        Return the bitset of all documents with at least one tag.
+        """
+        if self._all is None:
+            self._all = self.union(*self._bits)
+        return self._all
+
+    def size(self, tag):
+        """
+        Return the number of documents tagged with `tag`.
+        """
+        count = self._counts.get(tag)
+        if count is None:
+            count = self._counts[tag] = self.count(self.bits(tag))
+        return count
+
+    def intersection(self, *tags):
+        """
+        Return the bitset of documents carrying all of the given tags.
+
+        The tags are intersected starting with the rarest one, and no more
+        tags are looked at once the intersection is empty.
+        """
+        if not tags:
+            return 0
+        tags = sorted(tags, key=self.size)
+        bits = self.bits(tags[0])
+        for tag in tags[1:]:
+            if not bits:
+                break
+            bits &= self.bits(tag)
+        return bits
+
+    def union(self, *tags):
+        """
+        Return the bitset of documents carrying any of the given tags.
+        """
+        bits = 0
+        for tag in tags:
+            bits |= self.bits(tag)
+        return bits
+
+    def difference(self, bits, *tags):
+        """
+        Return the documents in bitset `bits` that carry none of the given tags.
+        """
+        return bits & ~self.union(*tags)
+
+    @staticmethod
+    def count(bits):
+        """
+        Return the number of documents in bitset `bits`.
+        """
+        return bin(bits).count("1")
+
+    def names(self, bits):
+        """
+        Return the names of all documents in bitset `bits` ordered by ID.
+        """
+        # the reversed binary representation has a '1' at every document ID
+        flags = bin(bits)[:1:-1]
+        names = []
+        docid = flags.find("1")
+        while docid >= 0:
+            names.append(self._names[docid])
+            docid = flags.find("1", docid + 1)
+        return names
+
+    def items(self):
+        """
+        Yield every tag with its list of names, in the order of `tags`.
+        """
+        for tag in self.tags:
+            yield tag, self.names(self.bits(tag))
+
+    def subsets(self, bits):
+        """
+        Yield every tag and the bitset of the documents in `bits` carrying it,
+        in the order of `tags`.
+        """
+        for tag in self.tags:
+            yield tag, self.bits(tag) & bits
+
+    def todict(self):
+        """
+        Return a plain dictionary mapping each tag to its list of names.
+        """
+        return {tag: self.names(bits) for tag, bits in self._bits.items()}
+
+    def incidence(self):
+        """
+        Return the document x tag incidence matrix.
+
+        Requires NumPy, which is only imported when needed.
+
+        Returns
+        -------
+        numpy.ndarray
+            matrix of 0 and 1 (``uint8``) with a row per document ID and a
+            column per tag in the order of `tags`
+        """
+        import numpy as np
+        rowsize = (len(self._names) + 7) // 8
+        matrix = np.zeros((len(self._names), len(self._bits)), dtype=np.uint8)
+        for column, bits in enumerate(self._bits.values()):
+            packed = np.frombuffer(bits.to_bytes(rowsize, 'little'), dtype=np.uint8)
+            matrix[:, column] = np.unpackbits(packed, count=len(self._names), bitorder='little')
+        return matrix
+
+    def cooccurrence(self, *tags, matrix=None):
+        """
+        Return the number of documents shared by every pair of tags.
+
+        All pairs are counted in a single matrix product of the incidence
+        matrix with itself. Given `tags`, only the documents carrying all of
+        them are counted, e.g. ``cooccurrence("neuron")[i, j]`` is the number
+        of documents tagged with "neuron" and the i-th and j-th tag.
+
+        Parameters
+        ----------
+        tags : str
+            tags that all counted documents must have
+        matrix : numpy.ndarray, optional
+            result of `incidence()`, to avoid building it again
+
+        Returns
+        -------
+        numpy.ndarray
+            symmetric matrix of counts (``int64``) with a row and column per
+            tag in the order of `tags`, the diagonal holds the counts of
+            single tags
+        """
+        import numpy as np
+        if matrix is None:
+            matrix = self.incidence()
+        if tags:
+            rows = np.ones(len(matrix), dtype=bool)
+            positions = {tag: pos for pos, tag in enumerate(self.tags)}
+            for tag in tags:
+                if tag not in positions:
+                    return np.zeros((len(positions), len(positions)), dtype=np.int64)
+                rows &= matrix[:, positions[tag]].astype(bool)
+            matrix = matrix[rows]
+        # a float product uses BLAS and is exact up to 2**53 documents
+        values = matrix.astype(np.float64)
+        return np.rint(values.T @ values).astype(np.int64)
+
+    def query(self, expression):
+        """
+        Return the bitset of documents matching a boolean tag expression.
+
+        See `parse_query()` for the syntax. Negations are relative to all
+        documents with at least one tag, unknown tags match no document. The
+        results of the last `maxqueries` expressions are cached until the
+        index changes.
+
+        Example
+        -------
+
+            index.names(index.query("neuron & conductance-based & !multicompartment"))
+        """
+        tree = parse_query(expression) if isinstance(expression, str) else expression
+        bits = self._queries.get(tree)
+        if bits is not None:
+            self.hits += 1
+            self._queries.move_to_end(tree)
+            return bits
+        self.misses += 1
+        bits = self._evaluate(tree)
+        if self.maxqueries:
+            self._queries[tree] = bits
+            if len(self._queries) > self.maxqueries:
+                self._queries.popitem(last=False)
+        return bits
+
+    def select(self, expression):
+        """
+        Return the names of the documents matching `expression`, see `query()`.
+        """
+        return self.names(self.query(expression))
+
+    def _evaluate(self, node):
+        op, operand = node
+        if op == "tag":
+            return self.bits(operand)
+        if op == "not":
+            return self.everything() & ~self._evaluate(operand)
+        if op == "or":
+            bits = 0
+            everything = self.everything()
+            for child in operand:
+                bits |= self._evaluate(child)
+                if bits == everything:
+                    break
+            return bits
+        # "and": plain tags first, rarest first, then subexpressions, then
+        # negations, which can only remove documents
+        tags = [child[1] for child in operand if child[0] == "tag"]
+        negated = [child[1] for child in operand if child[0] == "not"]
+        others = [child for child in operand if child[0] not in ("tag", "not")]
+        bits = self.intersection(*tags) if tags else self.everything()
+        for child in others:
+            if not bits:
+                return 0
+            bits &= self._evaluate(child)
+        for child in negated:
+            if not bits:
+                return 0
+            bits &= ~self._evaluate(child)
+        return bits
+
+    @staticmethod
+    def fingerprint(filename):
+        """
+        Return the fingerprint (modification time and size) of a source file.
+        """
+        stat = os.stat(filename)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def stale(self):
+        """
+        Return the recorded source files that changed or disappeared since
+        the index was built. New source files are not detected.
+        """
+        changed = []
+        for filename, fingerprint in self.sources.items():
             try:
-                log.debug("scanning %s...", filename)
-                meta = DocMeta(filename)
-                nfiles += 1
+                if self.fingerprint(filename) != tuple(fingerprint):
+                    changed.append(filename)
+            except FileNotFoundError:
+                changed.append(filename)
+        return changed
+
+    def tobytes(self):
+        """
+        Serialize the index, see `save()`.
+        """
+        strings = "\0".join(chain(self._names, self._bits, self.sources)).encode('utf8')
+        rowsize = (len(self._names) + 7) // 8
+        parts = [self.HEADER.pack(self.MAGIC, self.VERSION, len(self._names), len(self._bits),
+                                  len(self.sources), len(strings)), strings]
+        parts.extend(bits.to_bytes(rowsize, 'little') for bits in self._bits.values())
+        parts.extend(self.FINGERPRINT.pack(*fingerprint) for fingerprint in self.sources.values())
+        return b"".join(parts)
+
+    @classmethod
+    def frombytes(cls, data):
+        """
+        Create an index from the output of `tobytes()`.
+
+        Parameters
+        ----------
+        data : bytes, mmap
+            serialized index
+
+        Raises
+        ------
+        ValueError
+            if `data` is not a serialized index of this version
+        """
+        if len(data) < cls.HEADER.size:
+            raise ValueError("not a tag index: too short")
+        magic, version, ndocs, ntags, nsources, strsize = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC:
+            raise ValueError("not a tag index")
+        if version != cls.VERSION:
+            raise ValueError("unsupported tag index version %d (expected %d)" % (version, cls.VERSION))
+        rowsize = (ndocs + 7) // 8
+        pos = cls.HEADER.size
+        if len(data) != pos + strsize + ntags * rowsize + nsources * cls.FINGERPRINT.size:
+            raise ValueError("tag index is truncated or corrupt")
+        strings = []
+        if ndocs + ntags + nsources:
+            strings = [sys.intern(text) for text in bytes(data[pos:pos + strsize]).decode('utf8').split("\0")]
+        pos += strsize
+        index = cls()
+        index._names = strings[:ndocs]
+        index._ids = {name: docid for docid, name in enumerate(index._names)}
+        for tag in strings[ndocs:ndocs + ntags]:
+            index._bits[tag] = int.from_bytes(data[pos:pos + rowsize], 'little')
+            pos += rowsize
+        for filename in strings[ndocs + ntags:]:
+            index.sources[filename] = cls.FINGERPRINT.unpack_from(data, pos)
+            pos += cls.FINGERPRINT.size
+        return index
+
+    def save(self, filename, writer=None):
+        """
+        Write the index to a compact binary file.
+
+        The file consists of a header with the format version and the
+        numbers of documents, tags and sources, one string table with all
+        document names, tags and source file names, a bitset of document IDs
+        of fixed size per tag, and a fingerprint per source file. Document
+        IDs and the order of tags are kept, so a loaded index produces
+        exactly the same output as the original one.
+
+        Parameters
+        ----------
+        filename : str, path
+            file to write
+        writer : OutputWriter, optional
+            writer to queue the file on, by default it is written right away
+        """
+        if writer is None:
+            write_if_changed(filename, self.tobytes())
+        else:
+            writer.write(filename, self.tobytes())
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Open an index written by `save()`.
+
+        The file is memory-mapped, so only the tables and bitsets are read,
+        without copying the whole file first.
+        """
+        with open(filename, 'rb') as infile:
+            if os.fstat(infile.fileno()).st_size == 0:
+                raise ValueError("not a tag index: %s is empty" % filename)
+            with mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return cls.frombytes(mapped)
+
+    def scan_files(self, filenames, cache=None):
+        """
+        Add the keywords of all given files, under the names of their rst
+        pages like in `ExtractUserDocs()`.
+        """
+        log.info("indexing keywords...")
+        stats = Counter()
+        with metrics.timed("scan_files"):
+            for meta in extract_docs(filenames, cache, stats, lazy=True):
                 log.debug("    keywords: %s", meta.keywords)
-                self.update(filename, meta.keywords)
-            except NoUserDocs as nodoc:
-                log.warning(nodoc)
-            except UnicodeDecodeError as exc:
-                log.warning("probably an incorrect input file: %s:", filename)
-                log.warning(exc)
+                self.update(meta.filename.with_suffix(".rst").name, meta.keywords)
+        metrics.add("scan_files", files=stats["files"])
+        self.log_summary(stats)
 
+    def log_summary(self, stats):
         log.info("found tags:")
         for tag in self.tags:
             log.info(" %5d %s", len(self[tag]), tag)
-        log.debug("%4d files in input", nfiles_total)
-        log.debug("%4d files with documentation", nfiles)
+        log.debug("%4d files in input", stats["files"])
+        log.debug("%4d files without marker skipped", stats["filtered"])
+        log.debug("%4d files with documentation", stats["documented"])
 
 
-def UserDocExtractor(
-        filenames,
-        basedir="..",
-        replace_ext='.rst',
-        outdir="userdocs/"
-        ):
+class _SourceTable(MutableMapping):
     """
-    Extract all user documentation from given files.
+    Fingerprints of source files, stored in the ``sources`` table.
+    """
+    def __init__(self, db):
+        self._db = db
 
-    This method searches for "BeginUserDocs" and "EndUserDocs" keywords and
-    extracts all text inbetween as user-level documentation. The keyword
-    "BeginUserDocs" may optionally be followed by a colon ":" and a comma
-    separated list of tags till the end of the line. Note that this allows tags
-    to contain spaces, i.e. you do not need to introduce underscores or hyphens
-    for multi-word tags.
+    def __getitem__(self, filename):
+        row = self._db.execute("SELECT mtime, size FROM sources WHERE path = ?", (filename,)).fetchone()
+        if row is None:
+            raise KeyError(filename)
+        return tuple(row)
 
-    Example
-    -------
+    def __setitem__(self, filename, fingerprint):
+        self._db.execute("INSERT OR REPLACE INTO sources (path, mtime, size) VALUES (?, ?, ?)",
+                         (filename,) + tuple(fingerprint))
 
-    /* BeginUserDocs: example, user documentation generator
+    def __delitem__(self, filename):
+        if not self._db.execute("DELETE FROM sources WHERE path = ?", (filename,)).rowcount:
+            raise KeyError(filename)
 
-    [...]
+    def __iter__(self):
+        for (filename,) in self._db.execute("SELECT path FROM sources ORDER BY rowid").fetchall():
+            yield filename
 
-    EndUserDocs */
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM sources").fetchone()[0]
 
-    This will extract "[...]" as documentation for the file and tag it with
-    'example' and 'user documentation generator'.
+    def clear(self):
+        self._db.execute("DELETE FROM sources")
 
-    The extracted documentation is written to a file in `basedir` named after
-    the sourcefile with ".rst" replacing the original extension.
+
+class SqliteTagIndex(TagIndex):
+    """
+    A `TagIndex` stored in a local SQLite database.
+
+    Documents, tags, the postings linking them and the fingerprints of the
+    source files are kept in tables of the database file, so the index
+    survives between runs and only the documents that changed need to be
+    indexed again (see `replace()`). Intersections, counts and the
+    combinations of tags with enough documents (see `combinations()`) are
+    computed in SQL on the indexed postings. Bitsets of single tags and
+    document names are fetched on demand, at most `maxbits` bitsets and
+    `maxnames` names are kept in memory, and `items()` streams the documents
+    of every tag from an ordered query.
+
+    Building the output still keeps a little state per document in memory:
+    the keywords of every page (for referenced index pages and removed
+    documents, see `ExtractUserDocs`) and the tags of every document in the
+    `BuildManifest`.
+
+    Document IDs and the order of tags are the same as with an in-memory
+    index that saw the same documents, so both produce the same output.
+    The changes are committed by `commit()` or on leaving a ``with`` block.
 
     Parameters
     ----------
+    filename : str, path
+        database file, created if it does not exist
+    maxqueries : int
+        number of query results to cache, see `TagIndex.query`
+    maxnames : int
+        number of document names to cache
+    maxbits : int
+        number of bitsets of single tags to cache
+
+    Raises
+    ------
+    ValueError
+        if `filename` is not a tag index database of this version
+    """
+    VERSION = 1
+    SCHEMA = """
+        CREATE TABLE documents (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+        CREATE TABLE tags (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+        CREATE TABLE postings (
+            tag INTEGER NOT NULL REFERENCES tags (id),
+            document INTEGER NOT NULL REFERENCES documents (id),
+            PRIMARY KEY (tag, document)
+        ) WITHOUT ROWID;
+        CREATE INDEX postings_document ON postings (document, tag);
+        CREATE TABLE sources (path TEXT PRIMARY KEY, mtime INTEGER NOT NULL, size INTEGER NOT NULL);
+    """
+    # number of parameters per statement, below SQLite's limit
+    BATCH = 500
+
+    def __init__(self, filename, maxqueries=256, maxnames=65536, maxbits=256):
+        super().__init__(maxqueries)
+        self.filename = filename
+        self.maxnames = maxnames
+        self.maxbits = maxbits
+        self._names = OrderedDict()
+        self._tagbits = OrderedDict()
+        self._db = sqlite3.connect(str(filename))
+        try:
+            version = self._db.execute("PRAGMA user_version").fetchone()[0]
+            if version == 0:
+                self._db.executescript(self.SCHEMA + "PRAGMA user_version = %d;" % self.VERSION)
+            elif version != self.VERSION:
+                raise ValueError("unsupported tag index database version %d (expected %d)"
+                                 % (version, self.VERSION))
+        except sqlite3.DatabaseError as exc:
+            self._db.close()
+            raise ValueError("%s is not a tag index database: %s" % (filename, exc)) from exc
+        except ValueError:
+            self._db.close()
+            raise
+        self.sources = _SourceTable(self._db)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        self.close()
+
+    def commit(self):
+        self._db.commit()
+
+    def close(self):
+        """
+        Close the database. Changes that were not committed are lost.
+        """
+        self._db.close()
 
-    filenames : iterable
-       Any iterable with input file names (relative to `basedir`).
+    def _invalidate(self):
+        super()._invalidate()
+        self._tagbits.clear()
 
-    basedir : str, path
-       Directory to which input `filenames` are relative.
+    @classmethod
+    def fromdict(cls, tags):
+        raise TypeError("SqliteTagIndex needs a database file, use TagIndex.fromdict()")
 
-    replace_ext : str
-       Replacement for the extension of the original filename when writing to `outdir`.
+    @staticmethod
+    def _tobits(ids):
+        """
+        Return the bitset of the given document IDs.
+        """
+        ids = [docid for docid, in ids]
+        if not ids:
+            return 0
+        # setting the bits in a buffer is linear, or-ing them into an int is not
+        buffer = bytearray(max(ids) // 8 + 1)
+        for docid in ids:
+            buffer[docid >> 3] |= 1 << (docid & 7)
+        return int.from_bytes(buffer, 'little')
+
+    def _tagid(self, tag):
+        row = self._db.execute("SELECT id FROM tags WHERE name = ?", (tag,)).fetchone()
+        return None if row is None else row[0]
+
+    def docid(self, name):
+        row = self._db.execute("SELECT id FROM documents WHERE name = ?", (name,)).fetchone()
+        if row is not None:
+            return row[0]
+        # documents are never deleted, so the IDs stay contiguous like in memory
+        docid = self._db.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+        self._db.execute("INSERT INTO documents (id, name) VALUES (?, ?)", (docid, name))
+        return docid
 
-    outdir : str, path
+    def update(self, name, tags):
+        docid = None
+        for tag in tags:
+            if not tag.strip():
+                log.warning("skipping tag %s for %s", repr(tag), name)
+                continue
+            if docid is None:
+                docid = self.docid(name)
+            self._db.execute("INSERT OR IGNORE INTO tags (name) VALUES (?)", (tag,))
+            self._db.execute("INSERT OR IGNORE INTO postings (tag, document) "
+                             "SELECT id, ? FROM tags WHERE name = ?", (docid, tag))
+        self._invalidate()
+
+    def _drop(self, docid, tagids):
+        """
+        Remove document `docid` from the given tags and delete tags left empty.
+        """
+        self._db.executemany("DELETE FROM postings WHERE tag = ? AND document = ?",
+                             [(tagid, docid) for tagid in tagids])
+        self._db.executemany("DELETE FROM tags WHERE id = ? AND NOT EXISTS "
+                             "(SELECT 1 FROM postings WHERE tag = ?)", [(tagid, tagid) for tagid in tagids])
+        self._invalidate()
+
+    def _document_tags(self, name):
+        """
+        Return the document ID of `name` and a dictionary of its tags to their IDs.
+        """
+        row = self._db.execute("SELECT id FROM documents WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return None, {}
+        rows = self._db.execute("SELECT tags.name, tags.id FROM postings JOIN tags ON tags.id = postings.tag "
+                                "WHERE postings.document = ?", (row[0],))
+        return row[0], dict(rows.fetchall())
+
+    def replace(self, name, tags):
+        docid, current = self._document_tags(name)
+        keep = set(tags)
+        removed = [tagid for tag, tagid in current.items() if tag not in keep]
+        if removed:
+            self._drop(docid, removed)
+        added = [tag for tag in tags if tag not in current]
+        if added:
+            self.update(name, added)
+
+    def discard(self, name):
+        docid, current = self._document_tags(name)
+        if current:
+            self._drop(docid, list(current.values()))
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(DISTINCT document) FROM postings").fetchone()[0]
+
+    @property
+    def tags(self):
+        rows = self._db.execute("SELECT name FROM tags ORDER BY id").fetchall()
+        yield from (tag for tag, in rows)
+
+    def __getitem__(self, tag):
+        if tag not in self:
+            raise KeyError(tag)
+        return self.names(self.bits(tag))
+
+    def __contains__(self, tag):
+        return self._tagid(tag) is not None
+
+    def bits(self, tag):
+        bits = self._tagbits.get(tag)
+        if bits is not None:
+            self._tagbits.move_to_end(tag)
+            return bits
+        bits = self._tobits(self._db.execute(
+            "SELECT document FROM postings JOIN tags ON tags.id = postings.tag WHERE tags.name = ?", (tag,)))
+        if self.maxbits:
+            self._tagbits[tag] = bits
+            if len(self._tagbits) > self.maxbits:
+                self._tagbits.popitem(last=False)
+        return bits
+
+    def combinations(self, maxtags=2, minsupport=1):
+        """
+        Enumerate the combinations of tags with at least `minsupport`
+        documents, like `tag_combinations()`.
+
+        The combinations of every size are counted in a single query that
+        joins the postings of each document with themselves, so no bitset of
+        a tag is needed; the documents of a combination are selected with
+        `intersection()` when it is yielded.
+        """
+        tagnames = dict(self._db.execute("SELECT id, name FROM tags").fetchall())
+        yield (), self.everything()
+        for size in range(1, maxtags + 1):
+            aliases = ["p%d" % num for num in range(size)]
+            columns = ", ".join(alias + ".tag" for alias in aliases)
+            joins = "".join(" JOIN postings {1} ON {1}.document = p0.document AND {1}.tag > {0}.tag".format(*pair)
+                            for pair in zip(aliases, aliases[1:]))
+            # tag IDs are in the order of `tags`, so this is the order of tag_combinations()
+            rows = self._db.execute("SELECT %s FROM postings p0%s GROUP BY %s HAVING COUNT(*) >= ? ORDER BY %s"
+                                    % (columns, joins, columns, columns), (max(1, minsupport),))
+            found = False
+            for row in rows:
+                found = True
+                combo = tuple(tagnames[tagid] for tagid in row)
+                yield combo, self.intersection(*combo)
+            if not found:
+                break
+
+    def subsets(self, bits):
+        """
+        Yield every tag and the bitset of the documents in `bits` carrying it,
+        from the postings of these documents only.
+        """
+        documents = dict()      # tag ID -> IDs of documents in bits
+        ids = self._docids(bits)
+        for start in range(0, len(ids), self.BATCH):
+            batch = ids[start:start + self.BATCH]
+            rows = self._db.execute("SELECT tag, document FROM postings WHERE document IN (%s)"
+                                    % ", ".join("?" * len(batch)), batch)
+            for tagid, docid in rows:
+                documents.setdefault(tagid, []).append((docid,))
+        for tagid, tag in self._db.execute("SELECT id, name FROM tags ORDER BY id").fetchall():
+            yield tag, self._tobits(documents.pop(tagid, ()))
+
+    def everything(self):
+        if self._all is None:
+            self._all = self._tobits(self._db.execute("SELECT DISTINCT document FROM postings"))
+        return self._all
+
+    def size(self, tag):
+        count = self._counts.get(tag)
+        if count is None:
+            count = self._counts[tag] = self._db.execute(
+                "SELECT COUNT(*) FROM postings JOIN tags ON tags.id = postings.tag WHERE tags.name = ?",
+                (tag,)).fetchone()[0]
+        return count
+
+    def intersection(self, *tags):
+        """
+        Return the bitset of documents carrying all of the given tags.
+
+        The documents are selected in SQL, as the documents with a posting
+        for every one of the tags.
+        """
+        tags = set(tags)
+        if not tags:
+            return 0
+        if len(tags) == 1:
+            return self.bits(tags.pop())
+        tagids = [self._tagid(tag) for tag in tags]
+        if None in tagids or len(tagids) > self.BATCH:
+            return super().intersection(*tags)
+        return self._tobits(self._db.execute(
+            "SELECT document FROM postings WHERE tag IN (%s) GROUP BY document HAVING COUNT(*) = ?"
+            % ", ".join("?" * len(tagids)), tagids + [len(tagids)]))
+
+    @staticmethod
+    def _docids(bits):
+        """
+        Return the document IDs in bitset `bits`.
+        """
+        flags = bin(bits)[:1:-1]
+        ids = []
+        docid = flags.find("1")
+        while docid >= 0:
+            ids.append(docid)
+            docid = flags.find("1", docid + 1)
+        return ids
+
+    def names(self, bits):
+        ids = self._docids(bits)
+        missing = [docid for docid in ids if docid not in self._names]
+        for start in range(0, len(missing), self.BATCH):
+            batch = missing[start:start + self.BATCH]
+            rows = self._db.execute("SELECT id, name FROM documents WHERE id IN (%s)"
+                                    % ", ".join("?" * len(batch)), batch)
+            self._names.update(rows)
+        names = []
+        for docid in ids:
+            names.append(self._names[docid])
+            self._names.move_to_end(docid)
+        while len(self._names) > self.maxnames:
+            self._names.popitem(last=False)
+        return names
+
+    def items(self):
+        # a single ordered pass over the postings, instead of a query per tag
+        rows = self._db.execute("SELECT tags.name, documents.name FROM postings "
+                                "JOIN tags ON tags.id = postings.tag "
+                                "JOIN documents ON documents.id = postings.document "
+                                "ORDER BY tags.id, documents.id")
+        for tag, group in groupby(rows, key=itemgetter(0)):
+            yield tag, [name for tag, name in group]
+
+    def todict(self):
+        return dict(self.items())
+
+    def totagindex(self):
+        """
+        Return an in-memory `TagIndex` with the same contents.
+        """
+        index = TagIndex(self.maxqueries)
+        index._names = [name for name, in self._db.execute("SELECT name FROM documents ORDER BY id")]
+        index._ids = {name: docid for docid, name in enumerate(index._names)}
+        for tag in self.tags:
+            index._bits[tag] = self.bits(tag)
+        index.sources = dict(self.sources)
+        return index
+
+    def tobytes(self):
+        return self.totagindex().tobytes()
+
+    def incidence(self):
+        return self.totagindex().incidence()
+
+    @classmethod
+    def frombytes(cls, data):
+        raise TypeError("SqliteTagIndex needs a database file, use TagIndex.frombytes()")
+
+    @classmethod
+    def load(cls, filename):
+        return cls(filename)
+
+
+def cooccurrence_report(index, minsupport=1, top=50):
+    """
+    Summarize the populated combinations of tags of an index.
+
+    Pairs are counted with one matrix product, triples with one product per
+    tag, see `TagIndex.cooccurrence`, without enumerating any combination.
+
+    Parameters
+    ----------
+    index : TagIndex
+        index to summarize
+    minsupport : int
+        minimum number of documents for a combination to count as populated
+    top : int
+        number of most populated pairs to list
+
+    Returns
+    -------
+    dict
+        numbers of "documents" and "tags", documents per tag, numbers of
+        populated "combinations" of 1, 2 and 3 tags, and the `top` "pairs"
+        as ``[tag, tag, count]``
+    """
+    import numpy as np
+    tags = list(index.tags)
+    matrix = index.incidence()
+    pairs = index.cooccurrence(matrix=matrix)
+    minsupport = max(1, minsupport)
+    upper = np.triu(pairs, k=1)
+    populated = {"1": int((np.diag(pairs) >= minsupport).sum()), "2": int((upper >= minsupport).sum()), "3": 0}
+    for pos, tag in enumerate(tags):
+        # count every triple once, at its first tag
+        counts = np.triu(index.cooccurrence(tag, matrix=matrix), k=1)[pos + 1:, pos + 1:]
+        populated["3"] += int((counts >= minsupport).sum())
+    order = np.argsort(-upper, axis=None, kind='stable')[:top]
+    rows, columns = np.unravel_index(order, upper.shape)
+    return {
+        "documents": len(index),
+        "tags": {tag: int(pairs[pos, pos]) for pos, tag in enumerate(tags)},
+        "minsupport": minsupport,
+        "combinations": populated,
+        "pairs": [[tags[row], tags[column], int(upper[row, column])]
+                  for row, column in zip(rows, columns) if upper[row, column]],
+    }
+
+
+def extract_docs(filenames, cache=None, stats=None, lazy=False):
+    '''
+    Extract the user documentation of all given files.
+
+    Files without user documentation are logged and skipped.
+
+    Parameters
+    ----------
+    filenames : iterable
+      paths of the files to scan
+    cache : ExtractionCache, optional
+      cache to take results from and store new results in
+    stats : Counter, optional
+      receives the number of scanned "files", of "documented" files and of
+      files "filtered" out without decoding because they lack the begin
+      marker
+    lazy : bool
+      only record where the documentation is instead of reading it (unless it
+      comes from the cache), see `DocMeta`
+
+    Yields
+    ------
+    DocMeta
+      meta data of each file with user documentation
+    '''
+    extract = cache.extract if cache else partial(DocMeta, lazy=lazy)
+    stats = stats if stats is not None else Counter()
+    for filename in filenames:
+        stats["files"] += 1
+        try:
+            log.debug("scanning %s...", filename)
+            with metrics.timed("extract", files=1):
+                meta = extract(filename)
+        except NoUserDocsMarker as nodoc:
+            log.debug(nodoc)
+            stats["filtered"] += 1
+            continue
+        except NoUserDocs as nodoc:
+            log.warning(nodoc)
+            continue
+        except UnicodeDecodeError as exc:
+            log.warning("probably an incorrect input file: %s:", filename)
+            log.warning(exc)
+            continue
+        stats["documented"] += 1
+        yield meta
+
+
+def UserDocExtractor(
+        filenames,
+        basedir="..",
+        replace_ext='.rst',
+        outdir="userdocs/"
+        ):
+    """
+    Extract all user documentation from given files.
+
+    This method searches for "BeginUserDocs" and "EndUserDocs" keywords and
+    extracts all text inbetween as user-level documentation. The keyword
+    "BeginUserDocs" may optionally be followed by a colon ":" and a comma
+    separated list of tags till the end of the line. Note that this allows tags
+    to contain spaces, i.e. you do not need to introduce underscores or hyphens
+    for multi-word tags.
+
+    Example
+    -------
+
+    /* BeginUserDocs: example, user documentation generator
+
+    [...]
+
+    EndUserDocs */
+
+    This will extract "[...]" as documentation for the file and tag it with
+    'example' and 'user documentation generator'.
+
+    The extracted documentation is written to a file in `basedir` named after
+    the sourcefile with ".rst" replacing the original extension.
+
+    Parameters
+    ----------
+
+    filenames : iterable
+       Any iterable with input file names (relative to `basedir`).
+
+    basedir : str, path
+       Directory to which input `filenames` are relative.
+
+    replace_ext : str
+       Replacement for the extension of the original filename when writing to `outdir`.
+
+    outdir : str, path
        Directory where output files are created.
 
     Returns
@@ -231,25 +1654,16 @@ def rewrite_short_description(doc, short_description="Short description"):
         original parameter doc with short_description section replaced
     '''
 
-    titles = getTitles(doc.userdoc)
-    if not titles:
+    if not doc.sections.children:
         raise ValueError("No sections found in '%s'!" % doc.filename)
     name = doc.filename.stem
-    for title, nexttitle in zip(titles, titles[1:]+[None]):
-        if title.group(1) != short_description:
-            continue
-        secstart = title.end()
-        secend = len(doc.userdoc) + 1  # last section ends at end of document
-        if nexttitle:
-            secend = nexttitle.start()
-        sdesc = doc.userdoc[secstart:secend].strip().replace('\n', ' ')
-        fixed_title = "%s – %s" % (name, sdesc)
-        newdoc = deepcopy(doc)
-        newdoc.userdoc = doc.userdoc[:title.start()] + \
-            fixed_title + "\n" + "=" * len(fixed_title) + "\n\n" + \
-            doc.userdoc[secend:]
-        return newdoc
-    raise ValueError("No section '%s' found in %s!" % (short_description, doc.filename))
+    section = doc.sections.find(short_description)
+    if section is None:
+        raise ValueError("No section '%s' found in %s!" % (short_description, doc.filename))
+    sdesc = section.content().strip().replace('\n', ' ')
+    fixed_title = "%s – %s" % (name, sdesc)
+    section.replace(fixed_title, "=" * len(fixed_title), "\n\n")
+    return doc
 
 
 def rewrite_see_also(doc, see_also="See also"):
@@ -272,8 +1686,7 @@ def rewrite_see_also(doc, see_also="See also"):
         original parameter doc with see_also section replaced
     '''
 
-    titles = getTitles(doc.userdoc)
-    if not titles:
+    if not doc.sections.children:
         raise ValueError("No sections found in '%s'!" % doc.filename)
 
     def rightcase(text):
@@ -297,26 +1710,18 @@ def rewrite_see_also(doc, see_also="See also"):
             return text.title()  # title-case any tag that is not an acronym
         return text   # return acronyms unmodified
 
-    for title, nexttitle in zip(titles, titles[1:]+[None]):
-        if title.group(1) != see_also:
-            continue
-        secstart = title.end()
-        secend = len(doc.userdoc) + 1  # last section ends at end of document
-        if nexttitle:
-            secend = nexttitle.start()
-        original = doc.userdoc[secstart:secend].strip().replace('\n', ' ')
-        if original:
-            log.info("dropping manual 'see also' list in %s user docs: '%s'", doc.filename, original)
-        newdoc = deepcopy(doc)
-        newdoc.userdoc=          doc.userdoc[:secstart] + \
-            "\n" + ", ".join([":doc:`{taglabel} <index_{tag}>`".format(tag=tag, taglabel=rightcase(tag)) \
-                             for tag in doc.keywords]) + "\n\n" + \
-            doc.userdoc[secend:]
-        return newdoc
-    raise ValueError("No section '%s' found in %s!" % (see_also, doc.filename))
-
-
-def write_rst_output(doc, newprefix="output/", newsuffix=".rst"):
+    section = doc.sections.find(see_also)
+    if section is None:
+        raise ValueError("No section '%s' found in %s!" % (see_also, doc.filename))
+    original = section.content().strip().replace('\n', ' ')
+    if original:
+        log.info("dropping manual 'see also' list in %s user docs: '%s'", doc.filename, original)
+    section.replace(body="\n" + ", ".join([":doc:`{taglabel} <index_{tag}>`".format(tag=tag, taglabel=rightcase(tag)) \
+                                            for tag in doc.keywords]) + "\n\n")
+    return doc
+
+
+def write_rst_output(doc, newprefix="output/", newsuffix=".rst", writer=None):
     """
     Write raw rst to a file and generate a wrapper with index
 
@@ -324,11 +1729,15 @@ def write_rst_output(doc, newprefix="output/", newsuffix=".rst"):
     ----------
     doc: DocMeta
         userdoc instance to modify
+    writer: OutputWriter, optional
+        writer to queue the file on, by default it is written right away
     """
     outfile = Path(newprefix) / doc.filename.with_suffix(newsuffix).name
     log.debug("write_rst_file: output to %s", outfile)
-    with outfile.open("w") as outfile:
-        outfile.write(doc.userdoc)
+    if writer is None:
+        write_if_changed(outfile, doc.userdoc)
+    else:
+        writer.write(outfile, doc.userdoc)
 
 
 def make_hierarchy(tags, *basetags):
@@ -341,8 +1750,9 @@ def make_hierarchy(tags, *basetags):
 
     Parameters
     ----------
-    tags : dict
-       flat dictionary of tag to entry
+    tags : dict, TagIndex
+       flat dictionary of tag to entry. A `TagIndex` is used directly, without
+       creating intermediate sets for every tag.
 
     basetags : iterable
        iterable of a subset of tags.keys(), if no basetags are given the
@@ -356,7 +1766,9 @@ def make_hierarchy(tags, *basetags):
        intersection of basetag.
     """
     if not basetags:
-        return tags
+        return tags.todict() if isinstance(tags, TagIndex) else tags
+    if isinstance(tags, TagIndex):
+        return HierarchyBuilder(tags, maxsize=0).hierarchy(*basetags)
 
     # items having all given basetags
     baseitems = set.intersection(*[set(items) for tag, items in tags.items() if tag in basetags])
@@ -374,273 +1786,1654 @@ def make_hierarchy(tags, *basetags):
     return {basetags: tree}
 
 
-def rst_index(hierarchy, current_tags=[], underlines='=-~', top=True):
+class HierarchyBuilder:
+    """
+    Build `make_hierarchy()` results for many combinations of tags.
+
+    The documents of a combination are derived from those of its parent
+    combination (the same tags without the last one) with a single
+    intersection. Building the hierarchy of a combination yields the
+    documents of all its child combinations as a by-product; these are kept
+    as well, so that most combinations are already known when their own
+    index is built. At most `maxsize` combinations with bitsets of at most
+    `maxbytes` in total are kept, the least recently used are evicted first.
+    The bitsets of large trees (e.g. in a `SqliteTagIndex`) span all their
+    documents, so their total size matters more than their number.
+
+    Parameters
+    ----------
+    index : TagIndex
+       tag index to build hierarchies from
+    maxsize : int
+       maximum number of combinations to keep
+    maxtags : int, optional
+       do not keep combinations of more tags than this
+    maxbytes : int
+       maximum total size of the kept bitsets
+    """
+    def __init__(self, index, maxsize=65536, maxtags=None, maxbytes=64 * 1024 * 1024):
+        self.index = index
+        self.maxsize = maxsize
+        self.maxtags = maxtags
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        self._docs = OrderedDict()
+        self._bytes = 0
+
+    def _remember(self, key, bits):
+        if self.maxtags is not None and len(key) > self.maxtags:
+            return
+        old = self._docs.pop(key, None)
+        if old is not None:
+            self._bytes -= (old.bit_length() + 7) // 8
+        self._docs[key] = bits
+        self._bytes += (bits.bit_length() + 7) // 8
+        while self._docs and (len(self._docs) > self.maxsize or self._bytes > self.maxbytes):
+            self._bytes -= (self._docs.popitem(last=False)[1].bit_length() + 7) // 8
+
+    def docs(self, *basetags):
+        """
+        Return the bitset of documents carrying all given tags.
+        """
+        key = tuple(sorted(tag for tag in basetags if tag in self.index))
+        bits = self._docs.get(key)
+        if bits is not None:
+            self.hits += 1
+            self._docs.move_to_end(key)
+            return bits
+        self.misses += 1
+        if not key:
+            return 0
+        if len(key) == 1:
+            return self.index.bits(key[0])
+        bits = self.docs(*key[:-1]) & self.index.bits(key[-1])
+        self._remember(key, bits)
+        return bits
+
+    def hierarchy(self, *basetags):
+        """
+        Same as `make_hierarchy(index, *basetags)`.
+        """
+        if not basetags:
+            return self.index.todict()
+        baseitems = self.docs(*basetags)
+        key = tuple(sorted(tag for tag in basetags if tag in self.index))
+        tree = dict()
+        covered = 0
+        if baseitems:
+            for subtag, docs in self.index.subsets(baseitems):
+                if subtag in basetags:
+                    continue
+                self._remember(tuple(sorted(key + (subtag,))), docs)
+                if docs:
+                    tree[subtag] = set(self.index.names(docs))
+                    covered |= docs
+        remaining = baseitems & ~covered
+        if tree and remaining:
+            tree[''] = set(self.index.names(remaining))
+        return {basetags: tree}
+
+
+def rst_index(hierarchy, current_tags=[], underlines='=-~', top=True):
+    """
+    Create an index page from a given hierarchical dict of documents.
+
+    The given `hierarchy` is pretty-printed and returned as a string.
+
+    Parameters
+    ----------
+    hierarchy : dict
+       dictionary or dict-of-dict returned from `make_hierarchy()`
+
+    current_tags : list
+       applied filters for the current index (parameters given to
+       `make_hierarchy()`. Defaults to `[]`, which doesn't display any filters.
+
+    underlines : iterable
+       list of characters to use for underlining deeper levels of the generated
+       index.
+
+    top : bool
+       optional argument keeping track of recursive calls. Calls from within
+       `rst_index` itself will always call with `top=False`.
+
+    Returns
+    -------
+
+    str
+       formatted pretty index.
+    """
+    return "".join(iter_rst_index(hierarchy, current_tags, underlines, top))
+
+
+class SectionMemo:
+    """
+    Rendered sections of index pages, shared between pages by
+    `iter_rst_index()`.
+
+    Sections are keyed by their title, underline and set of documents. When
+    their total length exceeds `maxchars`, the least recently used are
+    evicted first.
+
+    Parameters
+    ----------
+    maxchars : int
+       maximum total length of the kept sections
+    """
+    def __init__(self, maxchars=16 * 1024 * 1024):
+        self.maxchars = maxchars
+        self.chars = 0
+        self._sections = OrderedDict()
+
+    def __len__(self):
+        return len(self._sections)
+
+    def get(self, key):
+        text = self._sections.get(key)
+        if text is not None:
+            self._sections.move_to_end(key)
+        return text
+
+    def __setitem__(self, key, text):
+        old = self._sections.pop(key, None)
+        if old is not None:
+            self.chars -= len(old)
+        self._sections[key] = text
+        self.chars += len(text)
+        while self.chars > self.maxchars and len(self._sections) > 1:
+            self.chars -= len(self._sections.popitem(last=False)[1])
+
+
+def iter_rst_index(hierarchy, current_tags=[], underlines='=-~', top=True, memo=None):
+    """
+    Generate the text of `rst_index()` in chunks.
+
+    Sections listing the documents of a tag are often the same on many index
+    pages. If a `memo` (a `SectionMemo`) is given, the text of every such
+    section is kept there and reused by all pages rendered with the same
+    `memo`.
+
+    Yields
+    ------
+
+    str
+       consecutive pieces of the index page
+    """
+    def mktitle(t, ul, link=None):
+        text = t
+        if t != t.upper():
+            text = t.title()  # title-case any tag that is not an acronym
+        title = ':doc:`{text} <{filename}>`'.format(
+            text=text,
+            filename=link or "index_"+t)
+        text = title+'\n'+ul*len(title)+'\n\n'
+        return text
+
+    def mkitem(t):
+        return "* :doc:`%s`" % os.path.splitext(t)[0]
+
+    def section(title, items):
+        output = [mktitle(title, underlines[0])] if title else []
+        output.extend(mkitem(item) for item in sorted(items))
+        output.append("")
+        return "\n".join(output)
+
+    # the page is a newline separated list of items, like in "\n".join(items)
+    separator = ""
+    if top:
+        # Prevent warnings by adding an orphan role so Sphinx does not expect it in toctrees
+        orphan_text = ":orphan:" + "\n\n"
+        page_title = "Model directory"
+        description = """
+                       The model directory is organized and autogenerated by keywords (e.g., adaptive threshold,
+                       conductance-based etc.). Models that contain a specific keyword will be listed under that word.
+                       For more information on models, see our :ref:`intro to NEST models <modelsmain>`.
+                       """
+        if len(hierarchy.keys()) == 1:
+            page_title += ": " + ", ".join(current_tags)
+        yield orphan_text + page_title + "\n"
+        yield underlines[0]*len(page_title)+"\n" + "\n"
+        yield description + "\n"
+        separator = "\n"
+        if len(hierarchy.keys()) != 1:
+            underlines = underlines[1:]
+
+    for tags, items in sorted(hierarchy.items()):
+
+        if "NOINDEX" in tags:
+            continue
+        if isinstance(tags, str):
+            title = tags
+        else:
+            title = " & ".join(tags)
+        if not len(hierarchy) == 1:     # not print title if already selected by current_tags
+            title = title or None
+        else:
+            title = None
+        yield separator
+        separator = "\n"
+        if isinstance(items, dict):
+            if title:
+                yield mktitle(title, underlines[0]) + "\n"
+            yield from iter_rst_index(items, current_tags, underlines[1:], top=False, memo=memo)
+        elif memo is None:
+            yield section(title, items)
+        else:
+            key = (title, underlines[:1], frozenset(items))
+            text = memo.get(key)
+            if text is None:
+                text = memo[key] = section(title, items)
+            yield text
+
+
+def reverse_dict(tags):
+    """
+    Return the reversed dict-of-list
+
+    Given a dictionary `keys:values`, this function creates the inverted
+    dictionary `value:[key, key2, ...]` with one entry per value of the given
+    dict. Since many keys can have the same value, the reversed dict must have
+    list-of-keys as values.
+
+    Parameters
+    ----------
+
+    tags : dict
+       Values must be hashable to be used as keys for the result.
+
+    Returns
+    -------
+
+    dict
+       Mapping the original values to lists of original keys.
+    """
+    revdict = dict()
+    for tag, items in tags.items():
+        for item in items:
+            revdict.setdefault(item, list()).append(tag)
+    return revdict
+
+
+def tag_combinations(index, maxtags=2, minsupport=1):
+    """
+    Enumerate the combinations of tags that are shared by enough documents.
+
+    The combinations are built level by level like in frequent itemset
+    mining: a combination of L+1 tags is only considered if its first L tags
+    are shared by at least `minsupport` documents, and it is only extended
+    further if it qualifies itself. The work therefore grows with the number
+    of populated combinations instead of the number of all possible ones.
+
+    Combinations are returned in the same order as
+    ``chain(*[combinations(taglist, L) for L in range(maxtags + 1)])``,
+    skipping the ones with too little support. The empty combination, which
+    stands for all documents, is always returned first.
+
+    Parameters
+    ----------
+
+    index : TagIndex
+       tag index to enumerate
+
+    maxtags : int
+       maximum number of tags in a combination
+
+    minsupport : int
+       minimum number of documents a combination must have
+
+    Yields
+    ------
+
+    tuple
+       the combination (tuple of tags) and the bitset of its documents
+    """
+    if isinstance(index, SqliteTagIndex):
+        yield from index.combinations(maxtags, minsupport)
+        return
+    taglist = list(index.tags)
+    tagbits = [index.bits(tag) for tag in taglist]
+    minsupport = max(1, minsupport)
+
+    def supported(bits):
+        return bits and (minsupport == 1 or index.count(bits) >= minsupport)
+
+    yield (), index.union(*taglist)
+    level = [((pos,), bits) for pos, bits in enumerate(tagbits) if supported(bits)]
+    for size in range(1, maxtags + 1):
+        extended = list()
+        for positions, bits in level:
+            yield tuple(taglist[pos] for pos in positions), bits
+            if size == maxtags:
+                continue
+            for pos in range(positions[-1] + 1, len(taglist)):
+                subbits = bits & tagbits[pos]
+                if supported(subbits):
+                    extended.append((positions + (pos,), subbits))
+        level = extended
+
+
+def index_name(current_tags):
+    """
+    Return the file name of the index page for the given tags.
+    """
+    return "index%s.rst" % "".join(["_"+x for x in sorted(current_tags)])
+
+
+def _index_page_chunks(builder, current_tags, memo=None):
+    current_tags = sorted(current_tags)
+    hier = builder.hierarchy(*current_tags)
+    if not any(hier.values()):
+        log.debug("index %s is empyt!", str(current_tags))
+        return None
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("generating index for %s (%d files)...", str(current_tags),
+                  builder.index.count(builder.docs(*current_tags)) if current_tags else len(builder.index))
+    return iter_rst_index(hier, current_tags, memo=memo)
+
+
+def render_index_page(builder, current_tags, memo=None):
+    """
+    Return the text of the index page of a combination of tags, or `None` if
+    the index would be empty. See `write_index_page()`.
+    """
+    chunks = _index_page_chunks(builder, current_tags, memo)
+    if chunks is None:
+        return None
+    with metrics.timed("rst_index"):
+        return "".join(chunks)
+
+
+def write_index_page(builder, current_tags, outdir="userdocs/", writer=None, memo=None):
+    """
+    Create the index page of a single combination of tags.
+
+    Parameters
+    ----------
+
+    builder : HierarchyBuilder
+       builder for the hierarchy of the tag index
+
+    current_tags : iterable
+       combination of tags to create the index for
+
+    outdir : str, path
+       path to the intended output directory
+
+    writer : OutputWriter, optional
+       writer to queue the index page on, by default it is written right away.
+       The page is streamed to the file while it is rendered.
+
+    memo : SectionMemo, optional
+       rendered sections shared between index pages
+
+    Returns
+    -------
+
+    str
+        name of the generated file or `None` if the index would be empty
+    """
+    indexname = index_name(current_tags)
+    indextext = _index_page_chunks(builder, current_tags, memo)
+    if indextext is None:
+        return None
+    indextext = metrics.timed_chunks("rst_index", indextext)
+    if writer is None:
+        write_if_changed(os.path.join(outdir, indexname), indextext)
+    else:
+        writer.write(os.path.join(outdir, indexname), indextext)
+    return indexname
+
+
+def affected_combinations(tagsets, maxtags=2):
+    """
+    Return all combinations of tags whose index pages change if documents
+    with the given sets of tags are added, changed or removed.
+
+    The index page of a combination lists all documents carrying all of its
+    tags, so only combinations that are subsets of the tags of a changed
+    document are affected, plus the page of all documents.
+
+    Parameters
+    ----------
+
+    tagsets : iterable
+       old and new tags of all changed documents
+
+    maxtags : int
+       maximum number of tags in a combination
+
+    Returns
+    -------
+
+    set
+        combinations as sorted tuples of tags
+    """
+    combos = {()}
+    for tags in tagsets:
+        tags = sorted(set(tags))
+        for size in range(1, min(maxtags, len(tags)) + 1):
+            combos.update(combinations(tags, size))
+    return combos
+
+
+DOC_LINK_RE = re.compile(r':doc:`(?:[^`<]*<)?([^`<>]+)>?`')
+
+
+def referenced_combinations(keywords, allowlist=()):
+    """
+    Return the combinations of tags whose index pages are linked from
+    outside the generated indices.
+
+    These are the page of all documents, which is the entry point of the
+    toc-tree, the single tag pages in the "See also" section of every
+    document (see `rewrite_see_also()`) and the combinations in `allowlist`.
+
+    Parameters
+    ----------
+    keywords : iterable
+        lists of keywords of all documents
+    allowlist : iterable
+        further combinations (iterables of tags) that must get a page
+
+    Returns
+    -------
+    list
+        combinations as sorted tuples of tags, without duplicates
+    """
+    combos = {(): None}
+    for tags in keywords:
+        combos.update(((tag,), None) for tag in tags)
+    combos.update((tuple(sorted(tags)), None) for tags in allowlist)
+    return list(combos)
+
+
+def _reachable_combinations(builder, candidates, referenced, memo=None):
+    """
+    Render the index pages reachable from the `referenced` combinations.
+
+    Starting from the referenced pages, the index pages linked from every
+    rendered page are followed as well. Only combinations in `candidates`
+    get a page.
+
+    Returns
+    -------
+    dict
+        combination -> text of every non-empty reachable index page
+    """
+    byname = {index_name(combo)[:-4]: combo for combo in candidates}
+    pages = dict()
+    seen = set()
+    pending = [combo for combo in referenced if combo in candidates]
+    while pending:
+        combo = pending.pop()
+        if combo in seen:
+            continue
+        seen.add(combo)
+        text = render_index_page(builder, combo, memo)
+        if text is None:
+            continue
+        pages[combo] = text
+        pending.extend(byname[link] for link in DOC_LINK_RE.findall(text) if link in byname)
+    return pages
+
+
+class BuildManifest:
+    """
+    Record of the index pages of the last build, for incremental builds.
+
+    The manifest keeps the tags of every document, the combination of tags
+    of every generated index page and the options the pages were generated
+    with. The index page of a combination depends on exactly the documents
+    carrying all of its tags, so after documents were added, removed or
+    retagged only the pages of the combinations in
+    `affected_combinations()` of their old and new tags need to be generated
+    again, see `CreateTagIndices`.
+    """
+    version = 2
+
+    def __init__(self, filename):
+        self.filename = Path(filename)
+        self.options = None
+        self.documents = {}     # document name -> sorted tags
+        self.pages = {}         # name of index page -> sorted tags
+        self.aliases = {}       # name of alias page -> name of the index page it refers to
+        self._load()
+
+    def _load(self):
+        try:
+            with self.filename.open('r', encoding='utf8') as infile:
+                data = json.load(infile)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as exc:
+            log.warning("ignoring unreadable build manifest %s: %s", self.filename, exc)
+            return
+        if data.get("version") != self.version:
+            log.info("discarding build manifest %s from another version", self.filename)
+            return
+        self.options = data["options"]
+        self.documents = data["documents"]
+        self.pages = {name: tuple(tags) for name, tags in data["pages"].items()}
+        self.aliases = data["aliases"]
+
+    def save(self):
+        write_if_changed(self.filename, json.dumps({
+            "version": self.version, "options": self.options,
+            "documents": self.documents, "pages": self.pages, "aliases": self.aliases}))
+
+
+def _document_tags(index):
+    """
+    Return a dictionary mapping every document of `index` to its sorted tags.
+    """
+    documents = dict()
+    for tag, names in index.items():
+        for name in names:
+            documents.setdefault(name, []).append(tag)
+    return {name: sorted(tags) for name, tags in documents.items()}
+
+
+def rst_alias(current_tags, target):
+    """
+    Create the page of a combination of tags that lists exactly the same
+    documents as the index page `target`, see `CreateTagIndices`.
+    """
+    page_title = "Model directory: " + ", ".join(current_tags)
+    return (":orphan:\n\n" + page_title + "\n" + "=" * len(page_title) + "\n\n"
+            "The models tagged with %s are exactly the ones listed in :doc:`%s`.\n"
+            % (" and ".join(current_tags), target[:-4]))
+
+
+def _affected_pages(builder, outdir, maxtags, manifest):
+    """
+    Return the combinations whose index pages are outdated according to the
+    `manifest` of the last build, see `CreateTagIndices`.
+    """
+    documents = _document_tags(builder.index)
+    changed = {name for name in chain(documents, manifest.documents)
+               if documents.get(name) != manifest.documents.get(name)}
+    affected = affected_combinations(chain((manifest.documents.get(name, []) for name in changed),
+                                           (documents.get(name, []) for name in changed)), maxtags)
+    affected.update(tuple(tags) for name, tags in manifest.pages.items()
+                    if not os.path.exists(os.path.join(outdir, name)))
+    log.info("%d documents changed, updating %d index pages", len(changed), len(affected))
+    return affected
+
+
+def _generate_tag_indices(builder, outdir, maxtags, minsupport, writer, memo, dedupe=False,
+                          affected=None, manifest=None):
+    """
+    Write the index pages of all combinations, see `CreateTagIndices`.
+
+    If `affected` is given, only the pages of these combinations are
+    written and the others are taken from the `manifest`.
+
+    Returns
+    -------
+    tuple
+        dict of the name of every index page -> its combination of tags, in
+        the order of `tag_combinations()`, and dict of the name of every
+        alias page -> name of the page it refers to
+    """
+    previous = {tuple(tags): name for name, tags in manifest.pages.items()} if manifest else {}
+    generated = dict()
+    aliases = dict()
+    canonical = dict()      # bitset of documents -> name of the first page listing them
+    for combo, docs in tqdm(tag_combinations(builder.index, maxtags, minsupport), unit="idx",
+                            desc="keyword indices", disable=not log.isEnabledFor(logging.INFO)):
+        combo = tuple(sorted(combo))
+        target = canonical.get(docs) if dedupe else None
+        if target is not None and not any(subset for tag, subset in builder.index.subsets(docs)
+                                          if tag not in combo):
+            target = None       # all tags of its documents are in combo, so the index would be empty
+        if affected is None or combo in affected or \
+                manifest.aliases.get(previous.get(combo)) != target:
+            indexname = index_name(combo)
+            if target is None:
+                indexname = write_index_page(builder, combo, outdir, writer, memo)
+            elif writer is None:
+                write_if_changed(os.path.join(outdir, indexname), rst_alias(combo, target))
+            else:
+                writer.write(os.path.join(outdir, indexname), rst_alias(combo, target))
+        else:
+            indexname = previous.get(combo)
+        if indexname:
+            generated[indexname] = combo
+            if target is not None:
+                aliases[indexname] = target
+            elif dedupe:
+                canonical.setdefault(docs, indexname)
+    return generated, aliases
+
+
+def CreateTagIndices(tags, outdir="userdocs/", maxtags=2, minsupport=1, writer=None, referenced=None,
+                     manifest=None, dedupe=False):
+    """
+    This function generates all combinations of tags and creates an index page
+    for each combination using `rst_index`.
+
+    Only combinations shared by at least `minsupport` documents are
+    considered, see `tag_combinations()`.
+
+    Parameters
+    ----------
+
+    tags : dict, TagIndex
+       dictionary of tags
+
+    outdir : str, path
+       path to the intended output directory (handed to `rst_index`.
+
+    maxtags : int
+       maximum number of tags combined in one index page. Earlier versions
+       used min(2, number of tags - 2), so with fewer than four tags they
+       generated fewer levels of pages, and none at all for a single tag; now
+       the limit is `maxtags` regardless of the number of tags.
+
+    minsupport : int
+       minimum number of documents for a combination of tags to get an index
+       page.
+
+    writer : OutputWriter, optional
+       writer to queue the index pages on, by default they are written right
+       away.
+
+    referenced : iterable, optional
+       combinations of tags whose pages are linked from elsewhere, see
+       `referenced_combinations()`. If given, only the index pages reachable
+       from these through the links between index pages are generated;
+       others can be requested later by adding them to the list.
+
+    manifest : BuildManifest, optional
+       record of the previous build, which is updated. If it was made with
+       the same options, only the pages of combinations that contain tags of
+       added, removed or retagged documents are generated again, as well as
+       recorded pages that are missing; otherwise all pages are generated.
+       Recorded pages that are not generated any more are deleted.
+       Incremental updates are not used together with `referenced`.
+
+    dedupe : bool
+       render the index of every set of documents only once. Later
+       combinations with the same documents get a short alias page linking
+       to the first one instead (see `rst_alias`). Not used together with
+       `referenced`.
+
+    Returns
+    -------
+
+    list
+        list of names of generated files.
+    """
+    if not isinstance(tags, TagIndex):
+        tags = TagIndex.fromdict(tags)
+    builder = HierarchyBuilder(tags, maxtags=maxtags)
+    memo = SectionMemo()
+    log.info("indices of up to %d out of %d keywords with at least %d documents",
+             maxtags, len(list(tags.tags)), minsupport)
+    options = {"maxtags": maxtags, "minsupport": minsupport, "dedupe": dedupe}
+    generated = dict()      # name of index page -> sorted tags
+    aliases = dict()        # name of alias page -> name of index page
+    with metrics.timed("CreateTagIndices"):
+        if referenced is None:
+            incremental = manifest is not None and manifest.options == options
+            affected = _affected_pages(builder, outdir, maxtags, manifest) if incremental else None
+            generated, aliases = _generate_tag_indices(builder, outdir, maxtags, minsupport, writer, memo,
+                                                       dedupe, affected, manifest if incremental else None)
+        else:
+            candidates = [tuple(sorted(combo)) for combo, docs in tag_combinations(tags, maxtags, minsupport)]
+            pages = _reachable_combinations(builder, set(candidates), referenced, memo)
+            for combo in candidates:
+                if combo in pages:
+                    generated[index_name(combo)] = combo
+                    path = os.path.join(outdir, index_name(combo))
+                    if writer is None:
+                        write_if_changed(path, pages[combo])
+                    else:
+                        writer.write(path, pages[combo])
+            log.info("%4d of %d index pages are referenced", len(generated), len(candidates))
+    indexfiles = list(generated)
+    if manifest is not None:
+        # pages of combinations that are empty, have too few documents or
+        # are not referenced any more
+        for indexname in manifest.pages:
+            if indexname not in generated:
+                try:
+                    os.remove(os.path.join(outdir, indexname))
+                    log.info("removed %s", indexname)
+                except FileNotFoundError:
+                    pass
+        manifest.options = options if referenced is None else None
+        manifest.documents = _document_tags(tags)
+        manifest.pages = generated
+        manifest.aliases = aliases
+    metrics.add("CreateTagIndices", files=len(indexfiles), aliases=len(aliases))
+    log.info("%4d non-empty index files generated", len(indexfiles))
+    if dedupe:
+        log.info("%4d index pages with the same documents as another one collapsed into aliases, "
+                 "%d distinct index pages rendered", len(aliases), len(indexfiles) - len(aliases))
+    log.debug("combination cache: %d hits, %d misses", builder.hits, builder.misses)
+    return indexfiles
+
+
+def _new_file_mode():
+    """
+    Return the permissions of a new file according to the process umask.
+
+    `tempfile.mkstemp()` always creates files readable only by the owner, so
+    a replaced file gets the mode a plain `open()` would have given it.
+    """
+    return 0o666 & ~_UMASK
+
+
+# the umask can only be read by setting it, which must not race with the
+# writer threads creating files, so it is read once on import
+_UMASK = os.umask(0o022)
+os.umask(_UMASK)
+
+
+def write_if_changed(filename, content):
+    """
+    Write `content` to `filename` unless the file already has that content.
+
+    The file is replaced atomically: the content is written to a temporary
+    file in the same directory, which is then renamed to `filename`. Readers
+    therefore never see a partially written file, and unchanged files keep
+    their modification time.
+
+    Parameters
+    ----------
+    filename : str, path
+        file to write
+    content : str, bytes, iterable
+        new content of the file, strings are encoded as UTF-8. An iterable
+        of strings or bytes is streamed to the file chunk by chunk, see
+        `_stream_if_changed()`.
+
+    Returns
+    -------
+    bool
+        whether the file was written
+    """
+    filename = Path(filename)
+    if not isinstance(content, (str, bytes, bytearray)):
+        return _stream_if_changed(filename, content)
+    data = content.encode('utf8') if isinstance(content, str) else content
+    try:
+        if filename.stat().st_size == len(data) and filename.read_bytes() == data:
+            return False
+        mode = filename.stat().st_mode & 0o777
+    except FileNotFoundError:
+        mode = _new_file_mode()
+    fd, tmpname = tempfile.mkstemp(dir=filename.parent, prefix="." + filename.name + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as outfile:
+            outfile.write(data)
+        os.chmod(tmpname, mode)
+        os.replace(tmpname, filename)
+    except BaseException:
+        os.unlink(tmpname)
+        raise
+    return True
+
+
+def _stream_if_changed(filename, chunks):
+    """
+    Write the `chunks` to `filename` unless the file already has that content.
+
+    The chunks are compared with the existing file while they are produced.
+    Only at the first difference a temporary file is started, with the equal
+    part copied from the existing file, so neither an unchanged nor a
+    changed file is ever held in memory as a whole.
+    """
+    try:
+        old = filename.open('rb')
+    except FileNotFoundError:
+        old, mode = None, _new_file_mode()
+    else:
+        mode = os.fstat(old.fileno()).st_mode & 0o777
+    out, tmpname, same = None, None, 0
+    try:
+        for chunk in chunks:
+            data = chunk.encode('utf8') if isinstance(chunk, str) else chunk
+            if out is None:
+                if old is not None and old.read(len(data)) == data:
+                    same += len(data)
+                    continue
+                fd, tmpname = tempfile.mkstemp(dir=filename.parent, prefix="." + filename.name + ".",
+                                               suffix=".tmp")
+                out = os.fdopen(fd, 'wb')
+                if same:
+                    old.seek(0)
+                    out.write(old.read(same))
+            out.write(data)
+        if out is None:
+            if old is not None and not old.read(1):
+                return False
+            # the new content is a prefix of the old one (or there is no file)
+            fd, tmpname = tempfile.mkstemp(dir=filename.parent, prefix="." + filename.name + ".", suffix=".tmp")
+            out = os.fdopen(fd, 'wb')
+            if same:
+                old.seek(0)
+                out.write(old.read(same))
+        out.close()
+        os.chmod(tmpname, mode)
+        os.replace(tmpname, filename)
+    except BaseException:
+        if out is not None:
+            out.close()
+            os.unlink(tmpname)
+        raise
+    finally:
+        if old is not None:
+            old.close()
+    return True
+
+
+class OutputWriter:
+    """
+    Write generated files from a pool of threads.
+
+    Files are queued with `write()` and written by `jobs` threads using
+    `write_if_changed()`, so files whose content did not change are left
+    untouched and incremental Sphinx builds only re-read pages that really
+    changed. The numbers of files and bytes written and skipped are collected
+    in `stats`.
+
+    With `jobs` <= 1 every file is written right away in the calling thread.
+    """
+    def __init__(self, jobs=4):
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(jobs) if jobs > 1 else None
+        self._slots = threading.BoundedSemaphore(4 * max(jobs, 1))
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _write(self, filename, content):
+        size = 0
+        if isinstance(content, str):
+            content = content.encode('utf8')
+        if isinstance(content, (bytes, bytearray)):
+            size = len(content)
+        else:
+            def counted(chunks):
+                nonlocal size
+                for chunk in chunks:
+                    data = chunk.encode('utf8') if isinstance(chunk, str) else chunk
+                    size += len(data)
+                    yield data
+            content = counted(content)
+        with metrics.timed("write"):
+            written = write_if_changed(filename, content)
+        if written:
+            metrics.add("write", files=1, **{"bytes written": size})
+        with self._lock:
+            if written:
+                self.stats["files written"] += 1
+                self.stats["bytes written"] += size
+            else:
+                self.stats["files skipped"] += 1
+                self.stats["bytes skipped"] += size
+
+    def write(self, filename, content):
+        """
+        Queue `content` to be written to `filename`.
+
+        `content` may also be an iterable of chunks, e.g. a generator, which
+        is then consumed in a writer thread.
+        """
+        if self._pool is None:
+            self._write(filename, content)
+            return
+        self._slots.acquire()     # limit the amount of queued content
+        future = self._pool.submit(self._write, filename, content)
+        future.add_done_callback(lambda future: self._slots.release())
+        self._pending.append(future)
+
+    def write_now(self, filename, content):
+        """
+        Write `content` to `filename` in the calling thread, e.g. chunks
+        that can only be produced there.
+        """
+        self._write(filename, content)
+
+    def merge(self, stats):
+        """
+        Add the statistics of another writer, e.g. one of a worker process.
+        """
+        with self._lock:
+            self.stats.update(stats)
+
+    def flush(self):
+        """
+        Wait until all queued files are written.
+
+        Raises the first error that occurred while writing.
+        """
+        pending, self._pending = self._pending, []
+        for future in pending:
+            future.result()
+
+    def close(self):
+        self.flush()
+        if self._pool is not None:
+            self._pool.shutdown()
+        log.info("output: %d files written (%d bytes), %d unchanged files skipped (%d bytes)",
+                 self.stats["files written"], self.stats["bytes written"],
+                 self.stats["files skipped"], self.stats["bytes skipped"])
+
+
+class MemoryWriter:
+    """
+    Collect generated files in memory instead of writing them.
+
+    Has the interface of `OutputWriter`; `files` maps the name of every
+    written file to its content, in the order they were written.
+    """
+    def __init__(self):
+        self.stats = Counter()
+        self.files = OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, filename, content):
+        if not isinstance(content, (str, bytes, bytearray)):
+            content = "".join(content)
+        self.files[str(filename)] = content
+        self.stats["files written"] += 1
+
+    write_now = write
+
+    def merge(self, stats):
+        self.stats.update(stats)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class JsonWriter:
+    """
+    Helper class to have a unified data output interface.
+    """
+    def __init__(self, outdir, writer=None):
+        self.outdir = outdir
+        self.writer = writer
+        log.info("writing JSON files to %s", self.outdir)
+
+    def write(self, obj, name):
+        """
+        Store the given object with the given name.
+        """
+        outname = os.path.join(self.outdir, name + ".json")
+        if self.writer is None:
+            write_if_changed(outname, json.dumps(obj))
+        else:
+            self.writer.write(outname, json.dumps(obj))
+        log.info("data saved as " + outname)
+
+    def write_items(self, items, name):
+        """
+        Store a mapping given as an iterable of (key, value) pairs, e.g.
+        `TagIndex.items()`, without building it in memory first. The file is
+        the same as from ``write(dict(items), name)``; it is written in the
+        calling thread, which may be the only one that can produce `items`.
+        """
+        def chunks():
+            yield "{"
+            for num, (key, value) in enumerate(items):
+                yield "%s%s: %s" % (", " if num else "", json.dumps(key), json.dumps(value))
+            yield "}"
+        outname = os.path.join(self.outdir, name + ".json")
+        if self.writer is None:
+            write_if_changed(outname, chunks())
+        else:
+            self.writer.write_now(outname, chunks())
+        log.info("data saved as " + outname)
+
+
+ADORNMENT_CHARS = set('!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~')
+
+
+def _is_heading(title, underline):
+    '''
+    Check if the two given lines form a section title with its underline.
+    '''
+    if not title.strip() or title[0].isspace():
+        return False
+    char = underline[:1]
+    if char not in ADORNMENT_CHARS or underline != char * len(underline):
+        return False
+    if title == title[0] * len(title) and title[0] in ADORNMENT_CHARS:
+        return False    # two adornment lines in a row
+    return len(underline) >= min(3, len(title))
+
+
+class RstSection:
+    '''
+    A section of a restructured text document.
+
+    The section is stored exactly as it appears in the text: the title line,
+    the underline, the text up to the first subsection (`body`, starting with
+    the line break after the underline) and the subsections themselves.
+    '''
+    def __init__(self, title, underline, body="", children=None):
+        self.title = title
+        self.underline = underline
+        self.body = body
+        self.children = children if children is not None else []
+
+    def __repr__(self):
+        return "%s(%r, %d subsections)" % (type(self).__name__, self.title, len(self.children))
+
+    def __str__(self):
+        return "".join(self._chunks())
+
+    def _chunks(self):
+        yield self.title
+        yield "\n"
+        yield self.underline
+        yield self.body
+        for child in self.children:
+            yield from child._chunks()
+
+    def __iter__(self):
+        '''
+        Iterate over this section and all subsections in document order.
+        '''
+        yield self
+        for child in self.children:
+            yield from child
+
+    def content(self):
+        '''
+        Return the text of the section without its title, including all
+        subsections.
+        '''
+        return self.body + "".join(str(child) for child in self.children)
+
+    def replace(self, title=None, underline=None, body=""):
+        '''
+        Replace the content of this section (including all subsections) with
+        `body` and optionally change its title and underline.
+        '''
+        if title is not None:
+            self.title = title
+        if underline is not None:
+            self.underline = underline
+        self.body = body
+        self.children = []
+
+
+class RstDocument(RstSection):
+    '''
+    Section tree of a restructured text document.
+
+    All underline characters allowed by restructured text are recognized.
+    As in docutils, the level of a section is given by the order in which the
+    underline characters first appear in the document. The text before the
+    first section is kept as `body` of the document.
+    '''
+    def __init__(self, body="", children=None):
+        super().__init__(None, None, body, children)
+
+    def __repr__(self):
+        return "%s(%d sections)" % (type(self).__name__, len(self.children))
+
+    def _chunks(self):
+        yield self.body
+        for child in self.children:
+            yield from child._chunks()
+
+    def __iter__(self):
+        for child in self.children:
+            yield from child
+
+    def find(self, title):
+        '''
+        Return the first section with the given title or `None`.
+        '''
+        for section in self:
+            if section.title == title:
+                return section
+        return None
+
+    @classmethod
+    def parse(cls, text):
+        '''
+        Parse the sections of the given restructured text in a single pass.
+
+        Parameters
+        ----------
+        text : str
+          restructuredtext user documentation
+
+        Returns
+        -------
+        RstDocument
+          section tree that serializes back to exactly `text`
+        '''
+        lines = text.split('\n')
+        headings = []   # (start of title, end of underline, title, underline)
+        offset, lineno = 0, 0
+        while lineno < len(lines) - 1:
+            title, underline = lines[lineno], lines[lineno + 1]
+            if _is_heading(title, underline):
+                if len(title) != len(underline):
+                    log.warning("Length of section title '%s' (%d) does not match length of underline (%d)",
+                                title, len(title), len(underline))
+                start = offset
+                offset += len(title) + 1 + len(underline) + 1
+                headings.append((start, offset - 1, title, underline))
+                lineno += 2
+            else:
+                offset += len(title) + 1
+                lineno += 1
+
+        document = cls(text[:headings[0][0]] if headings else text)
+        levels = []     # underline characters in order of appearance
+        stack = [(-1, document)]
+        for num, (start, end, title, underline) in enumerate(headings):
+            nextstart = headings[num + 1][0] if num + 1 < len(headings) else len(text)
+            if underline[0] not in levels:
+                levels.append(underline[0])
+            level = levels.index(underline[0])
+            while stack[-1][0] >= level:
+                stack.pop()
+            section = RstSection(title, underline, text[end:nextstart])
+            stack[-1][1].children.append(section)
+            stack.append((level, section))
+        return document
+
+
+def ExtractUserDocs(listoffiles, basedir='..', outdir='userdocs/', cache=None, jobs=1,
+                    maxtags=2, minsupport=1, referenced_only=False, allowlist=(), manifest=None, dedupe=False,
+                    index=None, shard=None):
     """
-    Create an index page from a given hierarchical dict of documents.
+    Extract and build all user documentation and build tag indices.
 
-    The given `hierarchy` is pretty-printed and returned as a string.
+    Writes extracted information to JSON files in outdir. In particular the
+    list of seen tags mapped to files they appear in, and the indices generated
+    from all combinations of tags. The tag index itself is saved to
+    ``tags.idx`` (see `TagIndex.save`), from where it can be loaded without
+    scanning the sources again.
+
+    Every input file is read and parsed only once: the extracted `DocMeta`
+    is added to the tag index and rendered right away.
 
     Parameters
     ----------
-    hierarchy : dict
-       dictionary or dict-of-dict returned from `make_hierarchy()`
 
-    current_tags : list
-       applied filters for the current index (parameters given to
-       `make_hierarchy()`. Defaults to `[]`, which doesn't display any filters.
+    listoffiles : iterable
+       Any iterable with input file names (relative to `basedir`).
 
-    underlines : iterable
-       list of characters to use for underlining deeper levels of the generated
-       index.
+    basedir : str, path
+       Directory to which input `listoffiles` are relative.
 
-    top : bool
-       optional argument keeping track of recursive calls. Calls from within
-       `rst_index` itself will always call with `top=False`.
+    outdir : str, path
+       Directory where output files are created.
+
+    cache : ExtractionCache, optional
+       Cache of previously extracted documentation.
+
+    jobs : int
+       Number of worker processes for extraction and rendering. The output
+       does not depend on the number of workers.
+
+    maxtags, minsupport : int
+       Limits for the tag combinations that get an index page, see
+       `CreateTagIndices`.
+
+    referenced_only : bool
+       Only generate the index pages that are linked from the documents, the
+       toc-tree or other index pages, or listed in `allowlist`, see
+       `referenced_combinations`.
+
+    allowlist : iterable
+       Combinations of tags that always get an index page.
+
+    manifest : BuildManifest, optional
+       Record of the previous build, to only update the index pages that
+       changed. It is saved once all files are written.
+
+    dedupe : bool
+       Write alias pages for combinations of tags with the same documents as
+       an earlier one, see `CreateTagIndices`.
+
+    index : TagIndex, optional
+       Index to add the documents to, e.g. a `SqliteTagIndex` kept from an
+       earlier run. Documents that are no longer found are removed from it.
+       By default a new in-memory index is used.
+
+    shard : tuple, optional
+       ``(number, count)`` to only render the files of shard `number` of
+       `count` (see `shard_of`) and write a partial index to
+       ``outdir/shard-<number>-of-<count>.json`` instead of the tag indices.
+       The partial indices of all shards are combined by `MergeShards()`.
 
     Returns
     -------
 
-    str
-       formatted pretty index.
+    None
     """
-    def mktitle(t, ul, link=None):
-        text = t
-        if t != t.upper():
-            text = t.title()  # title-case any tag that is not an acronym
-        title = ':doc:`{text} <{filename}>`'.format(
-            text=text,
-            filename=link or "index_"+t)
-        text = title+'\n'+ul*len(title)+'\n\n'
-        return text
+    if shard is not None:
+        with OutputWriter() as writer:
+            _extract_shard(listoffiles, shard, basedir, outdir, cache, jobs, writer)
+        return
+    with OutputWriter() as writer:
+        index = TagIndex() if index is None else index
+        index.sources.clear()
+        stats = Counter()
+        # Gather all information and write RSTs
+
+        def fingerprinted(filenames):
+            for filename in filenames:
+                index.sources[str(filename)] = TagIndex.fingerprint(filename)
+                yield filename
+        filenames = fingerprinted(Path(basedir) / filename for filename in listoffiles)
+        seen_keywords = dict()
+        for name, keywords in scan_and_render(filenames, outdir, cache, stats, jobs=jobs, writer=writer):
+            _add_document(index, seen_keywords, name, keywords)
+        _write_indices(index, seen_keywords, stats, outdir, writer, maxtags, minsupport, referenced_only,
+                       allowlist, manifest, dedupe)
+    if manifest is not None:
+        manifest.save()
+
+
+def _add_document(index, seen_keywords, name, keywords):
+    """
+    Add the keywords of a rendered page to the index of a build.
+    """
+    if name in seen_keywords:
+        # the same page can be generated from several source files
+        index.update(name, keywords)
+    else:
+        index.replace(name, keywords)
+    seen_keywords[name] = keywords
 
-    def mkitem(t):
-        return "* :doc:`%s`" % os.path.splitext(t)[0]
 
-    output = list()
-    if top:
-        # Prevent warnings by adding an orphan role so Sphinx does not expect it in toctrees
-        orphan_text = ":orphan:" + "\n\n"
-        page_title = "Model directory"
-        description = """
-                       The model directory is organized and autogenerated by keywords (e.g., adaptive threshold,
-                       conductance-based etc.). Models that contain a specific keyword will be listed under that word.
-                       For more information on models, see our :ref:`intro to NEST models <modelsmain>`.
-                       """
-        if len(hierarchy.keys()) == 1:
-            page_title += ": " + ", ".join(current_tags)
-        output.append(orphan_text + page_title)
-        output.append(underlines[0]*len(page_title)+"\n")
-        output.append(description + "\n")
-        if len(hierarchy.keys()) != 1:
-            underlines = underlines[1:]
+def _write_indices(index, seen_keywords, stats, outdir, writer, maxtags, minsupport, referenced_only,
+                   allowlist, manifest, dedupe):
+    """
+    Index part of `ExtractUserDocs()` and `MergeShards()`, once all pages are
+    rendered and their keywords are in `index`.
+    """
+    data = JsonWriter(outdir, writer)
+    for name in list(index.files):
+        if name not in seen_keywords:
+            index.discard(name)
+    index.log_summary(stats)
+    if manifest is not None:
+        # pages of documents that are gone since the last build
+        for name in manifest.documents:
+            if name not in seen_keywords:
+                try:
+                    os.remove(os.path.join(outdir, name))
+                    log.info("removed %s", name)
+                except FileNotFoundError:
+                    pass
+
+    data.write_items(index.items(), "tags")
+    index.save(os.path.join(outdir, "tags.idx"), writer)
+
+    referenced = referenced_combinations(seen_keywords.values(), allowlist) if referenced_only else None
+    indexfiles = CreateTagIndices(index, outdir=outdir, maxtags=maxtags, minsupport=minsupport,
+                                  writer=writer, referenced=referenced, manifest=manifest, dedupe=dedupe)
+    data.write(indexfiles, "indexfiles")
 
-    for tags, items in sorted(hierarchy.items()):
+    toc_list = [name[:-4] for tag, names in index.items() for name in names]
+    idx_list = [indexfile[:-4] for indexfile in indexfiles]
+    data.write(list(dict.fromkeys(toc_list)) + list(dict.fromkeys(idx_list)), "toc-tree")
 
-        if "NOINDEX" in tags:
-            continue
-        if isinstance(tags, str):
-            title = tags
-        else:
-            title = " & ".join(tags)
-        if title and not len(hierarchy) == 1:   # not print title if already selected by current_tags
-            output.append(mktitle(title, underlines[0]))
-        if isinstance(items, dict):
-            output.append(rst_index(items, current_tags, underlines[1:], top=False))
-        else:
-            for item in sorted(items):
-                output.append(mkitem(item))
-            output.append("")
-    return "\n".join(output)
 
+SHARD_VERSION = 4
 
-def reverse_dict(tags):
+
+def shard_name(shard):
     """
-    Return the reversed dict-of-list
+    Return the name of the partial index file of `shard` (without ``.json``).
+    """
+    return "shard-%d-of-%d" % tuple(shard)
 
-    Given a dictionary `keys:values`, this function creates the inverted
-    dictionary `value:[key, key2, ...]` with one entry per value of the given
-    dict. Since many keys can have the same value, the reversed dict must have
-    list-of-keys as values.
 
-    Parameters
-    ----------
+def shard_of(filename, count):
+    """
+    Return the shard (0 to `count` - 1) of a source file.
 
-    tags : dict
-       Values must be hashable to be used as keys for the result.
+    The shard is taken from a hash of the path as given, relative to the
+    root of the source tree, so it is the same in every run and on every
+    host, wherever the tree is.
+    """
+    digest = hashlib.sha1(Path(filename).as_posix().encode('utf8')).digest()
+    return int.from_bytes(digest[:8], 'little') % count
 
-    Returns
-    -------
 
-    dict
-       Mapping the original values to lists of original keys.
+def parse_shard(text):
     """
-    revdict = dict()
-    for tag, items in tags.items():
-        for item in items:
-            revdict.setdefault(item, list()).append(tag)
-    return revdict
+    Return ``(number, count)`` from a shard selector ``"number/count"``, with
+    0 <= number < count.
+    """
+    try:
+        number, count = (int(part) for part in text.split("/"))
+    except ValueError:
+        raise ValueError("shard must be given as NUMBER/COUNT, not %s" % repr(text)) from None
+    if not 0 <= number < count:
+        raise ValueError("shard number must be at least 0 and less than %d, not %d" % (count, number))
+    return number, count
 
 
-def CreateTagIndices(tags, outdir="userdocs/"):
+def _extract_shard(listoffiles, shard, basedir, outdir, cache, jobs, writer):
     """
-    This function generates all combinations of tags and creates an index page
-    for each combination using `rst_index`.
+    Shard part of `ExtractUserDocs()`.
+
+    Renders the pages of the files in `shard` and writes the partial index
+    with the position of every file in `listoffiles`, see `MergeShards()`.
+    Source files are recorded relative to `basedir`, so partial indices of
+    hosts with the source tree in different places fit together.
+    """
+    number, count = shard
+    ordinals = dict()
+    sources = list()
+    walked = Counter()
+    # all shards must walk the same files in the same order
+    digest = hashlib.sha1()
+
+    def selected():
+        for filename in listoffiles:
+            ordinal = walked["files"]
+            walked["files"] += 1
+            digest.update(Path(filename).as_posix().encode('utf8') + b"\n")
+            if shard_of(filename, count) != number:
+                continue
+            path = Path(basedir) / filename
+            ordinals[str(path)] = ordinal
+            sources.append([ordinal, Path(filename).as_posix()] + list(TagIndex.fingerprint(path)))
+            yield path
+    stats = Counter()
+    rendered = scan_and_render(selected(), outdir, cache, stats, jobs=jobs, writer=writer, sources=True)
+    documents = [[ordinals[str(filename)], name, keywords] for name, keywords, filename in rendered]
+    log.info("shard %d of %d: %d of %d files, %d documents", number, count, len(sources), walked["files"],
+             len(documents))
+    JsonWriter(outdir, writer).write({
+        "version": SHARD_VERSION,
+        "shard": [number, count],
+        "files": walked["files"],
+        "digest": digest.hexdigest(),
+        "sources": sources,
+        "documents": documents,
+        "stats": {key: stats[key] for key in ("files", "filtered", "documented")},
+    }, shard_name(shard))
+
+
+def read_shards(filenames):
+    """
+    Read the partial indices written by sharded runs of `ExtractUserDocs()`.
+
+    Raises
+    ------
+    ValueError
+        if a file can not be read, or the files are not the partial indices
+        of all shards of the same list of files, each exactly once
+    """
+    shards = dict()
+    for filename in filenames:
+        try:
+            with open(filename, encoding='utf8') as infile:
+                shard = json.load(infile)
+        except OSError as exc:
+            raise ValueError("can not read partial index %s: %s" % (filename, exc)) from exc
+        except json.JSONDecodeError as exc:
+            raise ValueError("%s is not a partial index: %s" % (filename, exc)) from exc
+        if not isinstance(shard, dict) or shard.get("version") != SHARD_VERSION:
+            raise ValueError("%s is not a partial index of version %d" % (filename, SHARD_VERSION))
+        number, count = shard["shard"]
+        if tuple(shard["shard"]) in shards:
+            raise ValueError("shard %d of %d is given twice" % (number, count))
+        shard["directory"] = os.path.dirname(os.path.abspath(filename))
+        shards[number, count] = shard
+    counts = {count for number, count in shards}
+    if len(counts) > 1:
+        raise ValueError("partial indices of different numbers of shards: %s" % sorted(counts))
+    if len({(shard["files"], shard["digest"]) for shard in shards.values()}) > 1:
+        raise ValueError("partial indices of different lists of files")
+    count = counts.pop() if counts else 0
+    missing = [number for number in range(count) if (number, count) not in shards]
+    if missing or not shards:
+        raise ValueError("missing partial indices of shards %s of %d" % (missing, count))
+    return [shards[number, count] for number in range(count)]
+
+
+def MergeShards(filenames, outdir='userdocs/', maxtags=2, minsupport=1, referenced_only=False, allowlist=(),
+                manifest=None, dedupe=False, index=None, basedir=os.curdir):
+    """
+    Combine the partial indices of all shards and build the tag indices.
+
+    The documents of all shards are added to the index in the order the
+    files were found in, as recorded by the shards, so the result is the
+    same as from a single `ExtractUserDocs()` run over all files. Pages that
+    a shard rendered into another directory are copied to `outdir`.
 
     Parameters
     ----------
 
-    tags : dict
-       dictionary of tags
+    filenames : iterable
+       Partial index files written by ``ExtractUserDocs(shard=...)``, one for
+       every shard.
 
     outdir : str, path
-       path to the intended output directory (handed to `rst_index`.
+       Directory where output files are created.
 
-    Returns
-    -------
+    maxtags, minsupport, referenced_only, allowlist, manifest, dedupe, index
+       See `ExtractUserDocs`.
 
-    list
-        list of names of generated files.
-    """
-    taglist = list(tags.keys())
-    indexfiles = list()
-    depth = min(4, len(taglist))    # how many levels of indices to create at most
-    nindices = sum([comb(len(taglist), L) for L in range(depth-1)])
-    log.info("indices down to level %d → %d possible keyword combinations", depth, nindices)
-    for current_tags in tqdm(chain(*[combinations(taglist, L) for L in range(depth-1)]), unit="idx",
-                             desc="keyword indices", total=nindices):
-        current_tags = sorted(current_tags)
-        indexname = "index%s.rst" % "".join(["_"+x for x in current_tags])
-        hier = make_hierarchy(tags.copy(), *current_tags)
-        if not any(hier.values()):
-            log.debug("index %s is empyt!", str(current_tags))
-            continue
-        nfiles = len(set.union(*chain([set(subtag) for subtag in hier.values()])))
-        log.debug("generating index for %s...", str(current_tags))
-        indextext = rst_index(hier, current_tags)
-        with open(os.path.join(outdir, indexname), 'w') as outfile:
-            outfile.write(indextext)
-        indexfiles.append(indexname)
-    log.info("%4d non-empty index files generated", len(indexfiles))
-    return indexfiles
+    basedir : str, path
+       Root of the source tree on this host. The shards record source files
+       relative to it, the tag index records them below `basedir` like
+       `ExtractUserDocs()`.
 
+    Raises
+    ------
 
-class JsonWriter:
+    ValueError
+       if the partial indices do not belong together, see `read_shards()`
     """
-    Helper class to have a unified data output interface.
+    shards = read_shards(filenames)
+    outdir_abs = os.path.abspath(outdir)
+    with OutputWriter() as writer:
+        index = TagIndex() if index is None else index
+        index.sources.clear()
+        stats = Counter()
+        sources = list()
+        documents = list()
+        for shard in shards:
+            stats.update(shard["stats"])
+            sources.extend(shard["sources"])
+            documents.extend(ordinal_document + [shard["directory"]] for ordinal_document in shard["documents"])
+        for ordinal, filename, mtime, size in sorted(sources, key=lambda source: source[0]):
+            index.sources[str(Path(basedir) / filename)] = (mtime, size)
+        seen_keywords = dict()
+        directories = dict()
+        for ordinal, name, keywords, directory in sorted(documents, key=lambda document: document[0]):
+            _add_document(index, seen_keywords, name, keywords)
+            directories[name] = directory
+        for name, directory in directories.items():
+            if directory != outdir_abs:
+                with open(os.path.join(directory, name), encoding='utf8') as infile:
+                    writer.write(os.path.join(outdir, name), infile.read())
+        _write_indices(index, seen_keywords, stats, outdir, writer, maxtags, minsupport, referenced_only,
+                       allowlist, manifest, dedupe)
+    if manifest is not None:
+        manifest.save()
+
+
+def compile_patterns(patterns):
     """
-    def __init__(self, outdir):
-        self.outdir = outdir
-        log.info("writing JSON files to %s", self.outdir)
-
-    def write(self, obj, name):
-        """
-        Store the given object with the given name.
-        """
-        outname = os.path.join(self.outdir, name + ".json")
-        with open(outname, 'w') as outfile:
-            json.dump(obj, outfile)
-            log.info("data saved as " + outname)
-
-
-def getTitles(text):
-    '''
-    extract all sections from the given RST file
+    Compile shell-style patterns into a single matcher.
 
     Parameters
     ----------
-
-    text : str
-      restructuredtext user documentation
+    patterns : iterable
+       patterns as understood by `fnmatch`
 
     Returns
     -------
-
-    list
-      elements are the section title re.match objects
-    '''
-    titlechar = r'\+'
-    title_re = re.compile(r'^(?P<title>.+)\n(?P<underline>'+titlechar+r'+)$', re.MULTILINE)
-    titles = []
-    # extract all titles
-    for match in title_re.finditer(text):
-        log.debug("MATCH from %s to %s: %s", match.start(), match.end(), pformat(match.groupdict()))
-        if len(match.group('title')) != len(match.group('underline')):
-            log.warning("Length of section title '%s' (%d) does not match length of underline (%d)",
-                        match.group('title'),
-                        len(match.group('title')),
-                        len(match.group('underline')))
-        titles.append(match)
-    return titles
-
-
-def ExtractUserDocs(listoffiles, basedir='..', outdir='userdocs/'):
+    callable
+       function returning a true value for names matching any of the
+       patterns (case-insensitive where `fnmatch` is, too)
     """
-    Extract and build all user documentation and build tag indices.
+    flags = re.IGNORECASE if os.path.normcase('A') == 'a' else 0
+    regex = "|".join("(?:%s)" % translate(pattern) for pattern in patterns)
+    return re.compile(regex or "(?!)", flags).match
 
-    Writes extracted information to JSON files in outdir. In particular the
-    list of seen tags mapped to files they appear in, and the indices generated
-    from all combinations of tags.
 
-    Parameters are the same as for `UserDocExtractor` and are handed to it
-    unmodified.
+def sourcefiles(*globs, basedir=os.curdir, excludes=None, manifest=None, stats=None):
+    """
+    Find all files below `basedir` with a name matching any of `globs`.
 
-    Returns
-    -------
+    Files and directories with a name matching any of `excludes` are skipped,
+    excluded directories are not entered at all. Symbolic links to
+    directories are not followed. Files are found in the same order as with
+    `os.walk`.
 
-    None
-    """
-    data = JsonWriter(outdir)
-    # Gather all information and write RSTs
-    tags = UserDocExtractor(listoffiles, basedir=basedir, outdir=outdir)
-    data.write(tags, "tags")
+    Parameters
+    ----------
+    globs : str
+       patterns for the names of the files to find
 
-    indexfiles = CreateTagIndices(tags, outdir=outdir)
-    data.write(indexfiles, "indexfiles")
+    basedir : str, path
+       directory to search
 
-    toc_list = [name[:-4] for names in tags.values() for name in names]
-    idx_list = [indexfile[:-4] for indexfile in indexfiles]
+    excludes : list, optional
+       patterns of names to skip
 
-    with open(os.path.join(outdir, "toc-tree.json"), "w") as tocfile:
-        json.dump(list(set(toc_list)) + list(set(idx_list)), tocfile)
+    manifest : str, path, optional
+       file with a list of paths relative to `basedir`, one per line (e.g. the
+       output of ``git ls-files``). If given, only the files listed there are
+       considered instead of walking the directory tree.
 
+    stats : Counter, optional
+       receives the numbers of "visited" directory entries (or manifest
+       lines), of "pruned" excluded entries and of "yielded" files
 
-def sourcefiles(*globs, basedir=os.curdir, excludes=None):
+    Yields
+    ------
+    Path
+       path of each matching file
+    """
     excludes = excludes or ['*.swp', '.git', 'venv', 'conda', '_doxygen', 'build']
-    for path, dirs, names in os.walk(basedir):
-        path = Path(path)
-        log.debug("%s", path)
-        removedirs = set(chain.from_iterable((fnfilter(dirs, pattern) for pattern in excludes)))
-        if removedirs:
-            log.debug("ignoring %s", removedirs)
-        for name in removedirs:
-            dirs.remove(name)
-        for name in names:
-            if any([fnmatch(name, pat) for pat in excludes]):       # reject excludes
+    exclude = compile_patterns(excludes)
+    include = compile_patterns(globs)
+    stats = stats if stats is not None else Counter()
+
+    if manifest is not None:
+        yield from _manifest_files(manifest, basedir, include, exclude, stats)
+    else:
+        stack = [os.fspath(basedir)]
+        while stack:
+            path = stack.pop()
+            log.debug("%s", path)
+            dirs = list()
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        stats["visited"] += 1
+                        if exclude(entry.name):         # reject excludes
+                            log.debug("ignoring %s", entry.path)
+                            stats["pruned"] += 1
+                            continue
+                        try:
+                            isdir = entry.is_dir()
+                        except OSError:
+                            isdir = False
+                        if isdir:
+                            if not entry.is_symlink():
+                                dirs.append(entry.path)
+                            continue
+                        if include(entry.name) and entry.is_file():
+                            stats["yielded"] += 1
+                            yield Path(entry.path)
+            except OSError as exc:
+                log.warning("could not scan %s: %s", path, exc)
+            stack.extend(reversed(dirs))
+    log.debug("source files in %s: %d entries visited, %d pruned, %d files found",
+              basedir, stats["visited"], stats["pruned"], stats["yielded"])
+
+
+def _manifest_files(manifest, basedir, include, exclude, stats):
+    """
+    Manifest part of `sourcefiles()`.
+    """
+    with open(manifest, 'r', encoding='utf8') as infile:
+        for line in infile:
+            name = line.strip()
+            if not name:
+                continue
+            stats["visited"] += 1
+            parts = name.split('/')
+            if any(exclude(part) for part in parts):
+                stats["pruned"] += 1
                 continue
-            if not any([fnmatch(name, pat) for pat in globs]):      # reject not matching any globs
+            if not include(parts[-1]):
                 continue
-            if (path / name).is_file():
-                yield path / name
+            path = Path(basedir) / name
+            if path.is_file():
+                stats["yielded"] += 1
+                yield path
+            else:
+                log.warning("file %s listed in %s does not exist", path, manifest)
 
 
+def renderpage(doc, outdir="output/", writer=None):
+    """
+    Rewrite the sections of a single document and write it to `outdir`.
+
+    Parameters
+    ----------
+    doc : DocMeta
+        extracted user documentation
+    outdir : str, path
+        directory for the generated rst file
+    writer : OutputWriter, optional
+        writer to queue the rst file on
 
-def renderpages(filenames):
+    Returns
+    -------
+    bool
+        whether the page was written, i.e. no step failed
+    """
     steps = [
-        DocMeta,
-        rewrite_short_description,
-        rewrite_see_also,
-        write_rst_output,
+        ("rewrite_short_description", rewrite_short_description),
+        ("rewrite_see_also", rewrite_see_also),
+        ("write_rst_output", partial(write_rst_output, newprefix=outdir, writer=writer)),
     ]
 
-    for filename in filenames:
-        item = [filename]
-        for step in steps:
-            try:
-                item = [step(*item)]
-            except ValueError as exc:
-                log.warning("Could not run %s on %s:", step.__name__, filename)
-                log.exception(exc)
-                break
+    item = doc
+    for name, step in steps:
+        try:
+            with metrics.timed(name):
+                item = step(item)
+        except ValueError as exc:
+            log.warning("Could not run %s on %s: %s", name, doc.filename, exc)
+            log.debug("", exc_info=True)
+            return False
+    return True
+
+
+def renderpages(docs, outdir="output/", writer=None):
+    for doc in docs:
+        renderpage(doc, outdir, writer)
 
     #for filename in filenames:
     #    meta = DocMeta(filename)
@@ -658,17 +3451,586 @@ def renderpages(filenames):
     #    write_rst_files(doc, tags, outfile)
 
 
-def main():
-    inputfiles = ['source/**/*.h', 'source/**/*.py']
-    #inputfiles = ["models/*.h", "nestkernel/*.h"]
+def scan_and_render(filenames, outdir="output/", cache=None, stats=None, jobs=1, chunksize=32,
+                    writer=None, sources=False):
+    """
+    Extract and render the user documentation of all given files.
+
+    With `jobs` > 1 the files are split into chunks of `chunksize` files
+    that are processed by a pool of worker processes. Results are returned
+    in the order of `filenames` regardless of the number of workers, so the
+    tag index built from them is always the same.
+
+    Parameters
+    ----------
+    filenames : iterable
+        paths of the files to scan
+    outdir : str, path
+        directory for the generated rst files
+    cache : ExtractionCache, optional
+        cache of previously extracted documentation
+    stats : Counter, optional
+        receives the file counts of `extract_docs()`
+    jobs : int
+        number of worker processes
+    chunksize : int
+        number of files handed to a worker at once
+    writer : OutputWriter, optional
+        writer for the rst files. Worker processes write their files
+        themselves and only report their statistics to it.
+    sources : bool
+        also yield the path of the source file of every document
+
+    Yields
+    ------
+    tuple
+        name of the generated rst file and the list of keywords for every
+        file whose page was written, followed by the path of the file if
+        `sources` is true. Documents whose page could not be rendered are
+        left out, so that no index links to a missing page.
+    """
+    stats = stats if stats is not None else Counter()
+    if jobs <= 1:
+        for doc in extract_docs(filenames, cache, stats):
+            if not renderpage(doc, outdir, writer):
+                continue
+            name = doc.filename.with_suffix(".rst").name
+            yield (name, doc.keywords, doc.filename) if sources else (name, doc.keywords)
+        return
+
+    filenames = list(filenames)
+    chunks = [filenames[i:i + chunksize] for i in range(0, len(filenames), chunksize)]
+    log.info("processing %d files in %d chunks with %d workers", len(filenames), len(chunks), jobs)
+    cachefile = cache.filename if cache else None
+    with ProcessPoolExecutor(jobs, initializer=_init_worker, initargs=(cachefile,)) as pool:
+        for results, chunkstats, touched, writerstats, chunkmetrics in pool.map(
+                partial(_render_chunk, outdir=outdir), chunks):
+            stats.update(chunkstats)
+            metrics.merge(chunkmetrics)
+            if writer:
+                writer.merge(writerstats)
+            if cache:
+                cache.merge(touched, chunkstats["cache hits"], chunkstats["cache misses"])
+            for name, keywords, filename in results:
+                yield (name, keywords, filename) if sources else (name, keywords)
+
 
-    index = TagIndex()
+_worker = {}
 
-    def scanfiles():
-        yield from sourcefiles("*.py", "*.h", "*.cxx", basedir = "../..")
-    index.scan_files(scanfiles())
 
-    renderpages(scanfiles())
+def _init_worker(cachefile):
+    _worker["cache"] = ExtractionCache(cachefile) if cachefile else None
+
+
+def _render_chunk(filenames, outdir):
+    """
+    Worker side of `scan_and_render()`.
+    """
+    cache = _worker.get("cache")
+    stats = Counter()
+    results = list()
+    metrics.reset()
+    hits, misses = (cache.hits, cache.misses) if cache else (0, 0)
+    writer = OutputWriter(jobs=1)
+    for doc in extract_docs(filenames, cache, stats):
+        if renderpage(doc, outdir, writer):
+            results.append((doc.filename.with_suffix(".rst").name, doc.keywords, doc.filename))
+    touched = dict()
+    if cache:
+        stats["cache hits"] = cache.hits - hits
+        stats["cache misses"] = cache.misses - misses
+        touched = cache.collect()
+    return results, stats, touched, writer.stats, metrics.todict()
+
+
+class Watcher:
+    """
+    Keep the tag index of a source tree in memory and update the output when
+    source files change.
+
+    After an initial full build, `poll()` compares the modification times of
+    all source files with the previous ones. Only changed files are extracted
+    and rendered again, and only the index pages of tag combinations that
+    changed documents had or have (see `affected_combinations()`) are
+    regenerated. Index pages of combinations that became empty are removed.
+
+    Parameters
+    ----------
+    filesource : callable
+        returns an iterable of all source files, e.g. a call to
+        `sourcefiles()`
+    outdir : str, path
+        directory for the generated files
+    cache : ExtractionCache, optional
+        cache of previously extracted documentation
+    maxtags, minsupport : int
+        limits for the tag combinations that get an index page, see
+        `CreateTagIndices`
+    manifest : BuildManifest, optional
+        record of the last build in `outdir`. Pages of the last build that
+        are not generated any more are removed by `build()`, and the manifest
+        is updated after every change, so that a later incremental build
+        starts from what the watcher left.
+    """
+    def __init__(self, filesource, outdir="output/", cache=None, maxtags=2, minsupport=1, manifest=None):
+        self.filesource = filesource
+        self.outdir = outdir
+        self.cache = cache
+        self.maxtags = maxtags
+        self.minsupport = minsupport
+        self.manifest = manifest
+        self.index = TagIndex()
+        self.keywords = {}      # source file -> keywords
+        self.pages = {}         # page name -> source files it is generated from
+        self.stamps = {}        # source file -> (mtime, size)
+        self.indexpages = {}    # sorted tuple of tags -> name of index page
+
+    def scan(self):
+        stamps = dict()
+        for filename in self.filesource():
+            try:
+                stat = os.stat(filename)
+            except FileNotFoundError:
+                continue
+            stamps[filename] = (stat.st_mtime_ns, stat.st_size)
+        return stamps
+
+    def build(self):
+        """
+        Extract and render everything, like `ExtractUserDocs`.
+        """
+        self.stamps = self.scan()
+        with OutputWriter() as writer:
+            stats = Counter()
+            for doc in extract_docs(self.stamps, self.cache, stats):
+                if renderpage(doc, self.outdir, writer):
+                    self._add(doc)
+            self.index.log_summary(stats)
+            builder = HierarchyBuilder(self.index, maxtags=self.maxtags)
+            memo = SectionMemo()
+            for current_tags, docs in tag_combinations(self.index, self.maxtags, self.minsupport):
+                indexname = write_index_page(builder, current_tags, self.outdir, writer, memo)
+                if indexname:
+                    self.indexpages[tuple(sorted(current_tags))] = indexname
+            if self.manifest is not None:
+                generated = set(self.indexpages.values())
+                documents = set(self.index.files)
+                for name in chain(self.manifest.pages, self.manifest.documents):
+                    if name not in generated and name not in documents:
+                        self._remove(Path(self.outdir) / name)
+            self._write_json(writer)
+        self._save_manifest()
+
+    def poll(self):
+        """
+        Update the output for all source files changed since the last call.
+
+        Returns
+        -------
+        bool
+            whether any file changed
+        """
+        stamps = self.scan()
+        changed = [filename for filename, stamp in stamps.items() if self.stamps.get(filename) != stamp]
+        removed = [filename for filename in self.stamps if filename not in stamps]
+        self.stamps = stamps
+        if changed or removed:
+            self.update(changed, removed)
+        return bool(changed or removed)
+
+    def _add(self, doc):
+        name = doc.filename.with_suffix(".rst").name
+        self.keywords[doc.filename] = doc.keywords
+        self.pages.setdefault(name, []).append(doc.filename)
+        self.index.update(name, doc.keywords)
+
+    def _page_tags(self, name):
+        """
+        Return the tags of the page `name`, the union of the keywords of all
+        source files it is generated from.
+        """
+        return list(dict.fromkeys(tag for filename in self.pages.get(name, ()) for tag in self.keywords[filename]))
+
+    def update(self, changed, removed=()):
+        """
+        Extract and render the given changed files, drop the removed ones and
+        regenerate all index pages affected by them.
+        """
+        start = time.monotonic()
+        oldtags = dict()        # affected page name -> its tags before the update
+        with OutputWriter() as writer:
+            for filename in chain(removed, changed):
+                if filename in self.keywords:
+                    name = filename.with_suffix(".rst").name
+                    oldtags.setdefault(name, self._page_tags(name))
+                    del self.keywords[filename]
+                    self.pages[name].remove(filename)
+            for doc in extract_docs(changed, self.cache):
+                if renderpage(doc, self.outdir, writer):
+                    # other source files may generate the same page
+                    name = doc.filename.with_suffix(".rst").name
+                    oldtags.setdefault(name, self._page_tags(name))
+                    self.keywords[doc.filename] = doc.keywords
+                    self.pages.setdefault(name, []).append(doc.filename)
+            tagsets = list()
+            for name, tags in oldtags.items():
+                tagsets.append(tags)
+                if self.pages.get(name):
+                    tagsets.append(self._page_tags(name))
+                    self.index.replace(name, tagsets[-1])
+                else:
+                    self.pages.pop(name, None)
+                    self.index.discard(name)
+                    self._remove(Path(self.outdir) / name)
+
+            builder = HierarchyBuilder(self.index, maxtags=self.maxtags)
+            memo = SectionMemo()
+            combos = affected_combinations(tagsets, self.maxtags)
+            for current_tags in combos:
+                indexname = None
+                docs = builder.docs(*current_tags) if current_tags else self.index.union(*self.index.tags)
+                if all(tag in self.index for tag in current_tags) and \
+                        self.index.count(docs) >= max(1, self.minsupport):
+                    indexname = write_index_page(builder, current_tags, self.outdir, writer, memo)
+                oldname = self.indexpages.pop(current_tags, None)
+                if indexname:
+                    self.indexpages[current_tags] = indexname
+                elif oldname:
+                    self._remove(Path(self.outdir) / oldname)
+            self._write_json(writer)
+        self._save_manifest()
+        log.info("%d changed and %d removed files, %d index pages updated in %.3f s",
+                 len(changed), len(removed), len(combos), time.monotonic() - start)
+
+    def _remove(self, filename):
+        try:
+            os.remove(filename)
+            log.info("removed %s", filename)
+        except FileNotFoundError:
+            pass
+
+    def _save_manifest(self):
+        if self.manifest is None:
+            return
+        self.manifest.options = {"maxtags": self.maxtags, "minsupport": self.minsupport, "dedupe": False}
+        self.manifest.documents = _document_tags(self.index)
+        self.manifest.pages = {name: combo for combo, name in self.indexpages.items()}
+        self.manifest.aliases = {}
+        self.manifest.save()
+
+    def _write_json(self, writer):
+        data = JsonWriter(self.outdir, writer)
+        tags = self.index.todict()
+        data.write(tags, "tags")
+        self.index.sources = {str(filename): stamp for filename, stamp in self.stamps.items()}
+        self.index.save(os.path.join(self.outdir, "tags.idx"), writer)
+        positions = {tag: pos for pos, tag in enumerate(self.index.tags)}
+        order = sorted(self.indexpages, key=lambda combo: (len(combo), sorted(positions[t] for t in combo)))
+        indexfiles = [self.indexpages[combo] for combo in order]
+        data.write(indexfiles, "indexfiles")
+        toc_list = [name[:-4] for names in tags.values() for name in names]
+        idx_list = [indexfile[:-4] for indexfile in indexfiles]
+        data.write(list(dict.fromkeys(toc_list)) + list(dict.fromkeys(idx_list)), "toc-tree")
+
+    def run(self, interval=0.5):
+        """
+        Build everything and then poll for changes every `interval` seconds
+        until interrupted.
+        """
+        self.build()
+        log.info("watching for changes, press Ctrl-C to stop")
+        try:
+            while True:
+                time.sleep(interval)
+                if self.poll() and self.cache:
+                    self.cache.save()
+        except KeyboardInterrupt:
+            log.info("stopped watching")
+
+
+STUB_PAGE = ".. Placeholder for a page generated by extractor_userdocs, the content is provided at build time.\n"
+
+
+def _page_digest(text):
+    return hashlib.sha256(text.encode('utf8')).hexdigest()
+
+
+def _generate_pages(app):
+    """
+    Extract and render all pages into memory when the Sphinx builder starts.
+
+    Sphinx only reads documents that exist in the source directory, so a
+    small placeholder file is kept for every generated page; the real
+    content is handed to Sphinx in `_read_page()`. Placeholders of pages that
+    are no longer generated are removed. The main index page gets a hidden
+    toctree of all documents.
+    """
+    config = app.config
+    outdir = Path(app.srcdir) / config.userdocs_outdir
+    outdir.mkdir(parents=True, exist_ok=True)
+    os.makedirs(app.doctreedir, exist_ok=True)
+    cache = ExtractionCache(os.path.join(app.doctreedir, "userdocs-cache.json"))
+    basedir = os.path.join(app.confdir, config.userdocs_basedir)
+
+    with metrics.timed("sphinx pages"):
+        writer = MemoryWriter()
+        index = TagIndex()
+        keywords = dict()
+        for doc in extract_docs(sourcefiles(*config.userdocs_patterns, basedir=basedir), cache):
+            if not renderpage(doc, outdir, writer):
+                continue
+            index.update(doc.filename.with_suffix(".rst").name, doc.keywords)
+            keywords[doc.filename.stem] = doc.keywords
+        referenced = None
+        if config.userdocs_referenced_only:
+            allowlist = [parse_combination(line) for line in config.userdocs_index_allowlist]
+            referenced = referenced_combinations(keywords.values(), allowlist)
+        CreateTagIndices(index, outdir, config.userdocs_maxtags, config.userdocs_minsupport, writer=writer,
+                         referenced=referenced, dedupe=config.userdocs_dedupe_indices)
+        indexfile = str(outdir / index_name(()))
+        if indexfile in writer.files:
+            # the documents are only linked from the index pages, so they
+            # need a toctree to be part of the document tree
+            writer.files[indexfile] += "\n.. toctree::\n   :hidden:\n\n" + "".join(
+                "   %s\n" % Path(name).stem for name in index.files)
+    cache.save()
+
+    prefix = Path(config.userdocs_outdir).as_posix() + "/"
+    app.userdocs_pages = {prefix + Path(filename).stem: text for filename, text in writer.files.items()}
+    app.userdocs_keywords = {prefix + stem: tags for stem, tags in keywords.items()}
+    for docname in app.userdocs_pages:
+        write_if_changed(Path(app.srcdir) / (docname + ".rst"), STUB_PAGE)
+    for stub in outdir.glob("*.rst"):
+        if prefix + stub.stem not in app.userdocs_pages and stub.read_text(encoding='utf8') == STUB_PAGE:
+            stub.unlink()
+    log.info("%d pages generated for Sphinx", len(app.userdocs_pages))
+
+    if not hasattr(app.env, "userdocs_pages"):
+        app.env.userdocs_pages = dict()     # docname -> (digest, keywords) of the page that was read
+
+
+def _outdated_pages(app, env, added, changed, removed):
+    """
+    Return the generated pages whose content changed since they were read.
+
+    Their placeholders do not change, so Sphinx would not notice otherwise.
+    """
+    return [docname for docname, text in app.userdocs_pages.items()
+            if docname not in added and docname in env.userdocs_pages
+            and env.userdocs_pages[docname][0] != _page_digest(text)]
+
+
+def _read_page(app, docname, source):
+    text = app.userdocs_pages.get(docname)
+    if text is None:
+        return
+    source[0] = text
+    keywords = app.userdocs_keywords.get(docname, [])
+    app.env.userdocs_pages[docname] = (_page_digest(text), keywords)
+
+
+def _purge_page(app, env, docname):
+    if docname in env.userdocs_pages:
+        del env.userdocs_pages[docname]
+
+
+def _merge_pages(app, env, docnames, other):
+    """
+    Take over the pages read by a parallel reader process.
+    """
+    for docname in docnames:
+        if docname in other.userdocs_pages:
+            env.userdocs_pages[docname] = other.userdocs_pages[docname]
+
+
+def setup(app):
+    """
+    Register the extractor as Sphinx extension.
+
+    The model pages and keyword indices are generated in memory for every
+    build and served to Sphinx directly. The digest and keywords of every
+    page read are kept in ``env.userdocs_pages``, which is merged from the
+    processes of a parallel build (``sphinx-build -j N``). Messages go
+    through the Sphinx logger, so they respect ``-q`` and ``-W``.
+
+    Configuration values:
+
+    ``userdocs_basedir``
+        source tree to scan, relative to the configuration directory
+    ``userdocs_outdir``
+        directory of the generated pages, relative to the source directory
+    ``userdocs_patterns``
+        names of the files to scan
+    ``userdocs_maxtags``, ``userdocs_minsupport``
+        limits for the keyword combinations with an index page, see
+        `CreateTagIndices`
+    ``userdocs_referenced_only``, ``userdocs_index_allowlist``
+        only generate the index pages that are linked or listed in the
+        allowlist (strings of comma separated tags), see `ExtractUserDocs`
+    ``userdocs_dedupe_indices``
+        write alias pages for combinations with the same documents as
+        another one, see `CreateTagIndices`
+    """
+    global log
+    from sphinx.util import logging as sphinx_logging
+    log = sphinx_logging.getLogger(__name__)
+    if app.quiet:
+        # also silences the progress bars, which do not go through Sphinx
+        log.logger.setLevel(logging.WARNING)
+
+    app.add_config_value("userdocs_basedir", ".", "env")
+    app.add_config_value("userdocs_outdir", "userdocs", "env")
+    app.add_config_value("userdocs_patterns", ["*.py", "*.h", "*.cxx"], "env")
+    app.add_config_value("userdocs_maxtags", 2, "env")
+    app.add_config_value("userdocs_minsupport", 1, "env")
+    app.add_config_value("userdocs_referenced_only", False, "env")
+    app.add_config_value("userdocs_index_allowlist", [], "env")
+    app.add_config_value("userdocs_dedupe_indices", False, "env")
+    app.connect("builder-inited", _generate_pages)
+    app.connect("env-get-outdated", _outdated_pages)
+    app.connect("source-read", _read_page)
+    app.connect("env-purge-doc", _purge_page)
+    app.connect("env-merge-info", _merge_pages)
+    return {
+        "version": "1",
+        "env_version": 2,
+        "parallel_read_safe": True,
+        "parallel_write_safe": True,
+    }
+
+
+def parse_combination(text):
+    """
+    Return the tags of a comma separated combination of tags.
+    """
+    return [tag.strip() for tag in text.split(",") if tag.strip()]
+
+
+def read_allowlist(filename):
+    """
+    Read combinations of tags from a file, one comma separated combination
+    per line. Empty lines and lines starting with ``#`` are ignored.
+    """
+    with open(filename, encoding='utf8') as infile:
+        return [parse_combination(line) for line in infile
+                if line.strip() and not line.lstrip().startswith("#")]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract user documentation and generate tag indices.")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of worker processes for extraction and rendering")
+    parser.add_argument("--basedir", default="../..", help="root of the source tree to scan")
+    parser.add_argument("--outdir", default="output/", help="directory for the generated files")
+    parser.add_argument("--manifest", help="file listing the source files relative to the base "
+                        "directory (e.g. from 'git ls-files') instead of walking the directory tree")
+    parser.add_argument("--max-tags", type=int, default=2,
+                        help="maximum number of keywords combined in one index page")
+    parser.add_argument("--min-support", type=int, default=1,
+                        help="minimum number of documents for a keyword combination to get an index page")
+    parser.add_argument("--referenced-only", action="store_true",
+                        help="only generate the index pages linked from the documents, the toc-tree and "
+                        "other index pages or listed in the allowlist")
+    parser.add_argument("--index-allowlist", metavar="FILE",
+                        help="file with combinations of keywords that always get an index page, one "
+                        "comma separated combination per line")
+    parser.add_argument("--dedupe-indices", action="store_true",
+                        help="write a short alias page instead of a full index for combinations of keywords "
+                        "with the same documents as another one")
+    parser.add_argument("--tag-report", metavar="FILE",
+                        help="write the numbers of documents per keyword and of populated combinations of "
+                        "keywords to FILE as JSON (requires NumPy)")
+    parser.add_argument("--index-db", metavar="FILE",
+                        help="keep the tag index in the SQLite database FILE, which is reused and updated "
+                        "by later runs, instead of in memory")
+    parser.add_argument("--shard", metavar="NUMBER/COUNT",
+                        help="only extract and render shard NUMBER (from 0) of COUNT shards of the source "
+                        "files, chosen by a hash of their path, and write a partial index to the output "
+                        "directory instead of the keyword indices")
+    parser.add_argument("--merge", metavar="PARTIAL", nargs="+",
+                        help="combine the partial indices of all shards and generate the keyword indices "
+                        "in the output directory, as a build without shards would")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep running and update the output whenever source files change")
+    parser.add_argument("--interval", type=float, default=0.5,
+                        help="seconds between checks for changed files in watch mode")
+    parser.add_argument("--query", metavar="EXPRESSION",
+                        help="print the documents in the saved tag index of the output directory that "
+                        "match a boolean expression of tags, e.g. 'neuron & !multicompartment'")
+    parser.add_argument("-v", "--verbose", action="count", default=0,
+                        help="log progress (-v) or every file (-vv), by default only warnings are shown")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="write time, calls, bytes and files of every stage to FILE as JSON and "
+                        "print a summary")
+    args = parser.parse_args(argv)
+    shard = None
+    if args.shard:
+        try:
+            shard = parse_shard(args.shard)
+        except ValueError as exc:
+            parser.error(str(exc))
+        if args.watch or args.merge or args.index_db or args.tag_report:
+            parser.error("--shard can not be combined with --watch, --merge, --index-db or --tag-report")
+    if args.merge and args.watch:
+        parser.error("--merge can not be combined with --watch")
+
+    logging.basicConfig(level=[logging.WARNING, logging.INFO, logging.DEBUG][min(args.verbose, 2)])
+
+    if args.query:
+        try:
+            if args.index_db:
+                with SqliteTagIndex(args.index_db) as index:
+                    names = index.select(args.query)
+            else:
+                names = TagIndex.load(os.path.join(args.outdir, "tags.idx")).select(args.query)
+        except (ValueError, OSError) as exc:
+            parser.error("--query: %s" % exc)
+        for name in names:
+            print(name)
+        return
+
+    # shards can share an output directory, but not a cache file
+    cache = ExtractionCache(os.path.join(args.outdir, ".extraction-cache%s.json"
+                                         % ("-" + shard_name(shard) if shard else "")))
+    if args.watch:
+        watcher = Watcher(lambda: sourcefiles("*.py", "*.h", "*.cxx", basedir=args.basedir, manifest=args.manifest),
+                          outdir=args.outdir, cache=cache, maxtags=args.max_tags, minsupport=args.min_support,
+                          manifest=BuildManifest(os.path.join(args.outdir, ".build-manifest.json")))
+        watcher.run(args.interval)
+        cache.save()
+        return
+    index = SqliteTagIndex(args.index_db) if args.index_db else None
+    options = dict(outdir=args.outdir, maxtags=args.max_tags, minsupport=args.min_support,
+                   referenced_only=args.referenced_only,
+                   allowlist=read_allowlist(args.index_allowlist) if args.index_allowlist else (),
+                   manifest=BuildManifest(os.path.join(args.outdir, ".build-manifest.json")),
+                   dedupe=args.dedupe_indices, index=index)
+    with metrics.timed("total"):
+        if args.merge:
+            try:
+                MergeShards(args.merge, basedir=args.basedir, **options)
+            except ValueError as exc:
+                parser.error("--merge: %s" % exc)
+        elif shard:
+            # shards record the files relative to the source tree, see shard_of()
+            files = (os.path.relpath(filename, args.basedir)
+                     for filename in sourcefiles("*.py", "*.h", "*.cxx", basedir=args.basedir, manifest=args.manifest))
+            ExtractUserDocs(files, basedir=args.basedir, outdir=args.outdir, cache=cache, jobs=args.jobs, shard=shard)
+        else:
+            ExtractUserDocs(sourcefiles("*.py", "*.h", "*.cxx", basedir=args.basedir, manifest=args.manifest),
+                            basedir=os.curdir, cache=cache, jobs=args.jobs, **options)
+    if index is not None:
+        index.commit()
+        index.close()
+    cache.save()
+    if args.tag_report:
+        index = TagIndex.load(os.path.join(args.outdir, "tags.idx"))
+        with open(args.tag_report, "w") as outfile:
+            json.dump(cooccurrence_report(index, args.min_support), outfile, indent=2)
+    if args.profile:
+        with open(args.profile, "w") as outfile:
+            json.dump({"version": 1, "jobs": args.jobs, "stages": metrics.todict()}, outfile, indent=2)
+        print(metrics.report(), file=sys.stderr)
 
 
 if __name__ == '__main__':
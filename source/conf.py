@@ -6,7 +6,9 @@
 # -- Project information -----------------------------------------------------
 # https://www.sphinx-doc.org/en/master/usage/configuration.html#project-information
 
-import subprocess, os
+import subprocess, os, sys
+
+sys.path.insert(0, os.path.abspath('_ext'))
 
 project = 'keywords-extension'
 copyright = '2023, DT, JM'
@@ -16,7 +18,11 @@ release = '1'
 # -- General configuration ---------------------------------------------------
 # https://www.sphinx-doc.org/en/master/usage/configuration.html#general-configuration
 
-extensions = ['breathe']
+extensions = ['breathe', 'extractor_userdocs']
+
+# model pages and keyword indices generated from the user documentation in the sources
+userdocs_patterns = ['*.h']
+userdocs_outdir = 'userdocs'
 
 # this is where the xml should be placed
 breathe_projects = {"keywords-ext": "_doxygen/xml"}